@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+"""
+
+.. module:: benchmark
+   :synopsis: Benchmarks of the sanitiser, the CLI, the webservice and the dead drop on synthetic EPCIS data.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+try:
+    from . import synthetic
+except ImportError:
+    import synthetic
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from epcis_event_hash_generator import xml_to_py
+from tinydb import TinyDB
+
+from epcis_sanitiser import sanitiser
+from epcis_sanitiser import storage
+
+HASH_ALGORITHMS = ["sha256", "sha3_256", "sha384", "sha512"]
+
+# Sizes per suite for a full run and for a quick run (--quick), e.g. to check the harness itself
+SIZES = {
+    "sanitiser": {"full": [(100, 2), (1000, 2), (1000, 20)], "quick": [(50, 2)]},
+    "cli": {"full": {"files": 20, "events": 500, "jobs": [1, os.cpu_count() or 1]},
+            "quick": {"files": 2, "events": 20, "jobs": [1, 2]}},
+    "webservice": {"full": {"documents": 200, "events": 10, "lookups": 2000, "concurrency": [1, 16]},
+                   "quick": {"documents": 4, "events": 5, "lookups": 20, "concurrency": [2]}},
+    "dead_drop": {"full": {"requests": [1000, 10000, 100000], "polls": 1000, "concurrency": 16},
+                  "quick": {"requests": [100], "polls": 20, "concurrency": 2}},
+}
+
+
+def bench_sanitiser(results, size, repeat):
+    """
+    sanitise_events throughput per hash algorithm and document shape. Parsing is not measured.
+    """
+    for (event_count, epcs_per_event) in SIZES["sanitiser"][size]:
+        document = synthetic.xml_document(synthetic.events(event_count, epcs_per_event))
+        for hashalg in HASH_ALGORITHMS:
+            timings = []
+            # the first run is a warm up and not timed
+            for run in range(repeat + 1):
+                # the hash generator changes the parsed events, so every run gets a freshly parsed document
+                events = xml_to_py.event_list_from_epcis_document_str(document)
+                sanitiser.set_hash_cache_size(sanitiser.DEFAULT_HASH_CACHE_SIZE)
+                start = time.perf_counter()
+                sanitiser.sanitise_events(events, "https://never.land", hashalg)
+                if run:
+                    timings.append(time.perf_counter() - start)
+            _record(results, "sanitise_events",
+                    {"hashalg": hashalg, "events": event_count, "epcs_per_event": epcs_per_event},
+                    events_per_second=event_count / min(timings))
+
+
+def bench_cli(results, size, repeat):
+    """
+    Throughput of the CLI writing sanitised output files for a batch of input files.
+    """
+    from epcis_sanitiser.__main__ import main
+
+    sizes = SIZES["cli"][size]
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for i in range(sizes["files"]):
+            files.append(os.path.join(directory, "document{}.xml".format(i)))
+            with open(files[-1], "w") as file:
+                file.write(synthetic.xml_document(synthetic.events(sizes["events"], seed=i)))
+
+        for jobs in sizes["jobs"]:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                main(files + ["-b", "-j", str(jobs)])
+                timings.append(time.perf_counter() - start)
+            _record(results, "cli_batch", {"files": len(files), "events_per_file": sizes["events"], "jobs": jobs},
+                    files_per_second=len(files) / min(timings),
+                    events_per_second=len(files) * sizes["events"] / min(timings))
+
+
+def bench_webservice(results, size, repeat):
+    """
+    Latency and throughput of ingesting XML documents and of EPC lookups under concurrent load
+    for each storage backend, with the app called in-process.
+    """
+    from epcis_sanitiser import webservice
+
+    sizes = SIZES["webservice"][size]
+    documents = [synthetic.xml_document(synthetic.events(sizes["events"], seed=i)) for i in range(sizes["documents"])]
+    args = {"algorithm": "sha256", "log": "WARNING", "dead_drop_url": "https://never.land",
+            "sanitisation_config_file": None}
+    os.environ[webservice.SERVICE_CONFIG_ENV] = json.dumps({"args": args, "config": epcis_sanitiser.DEFAULT_CONFIG})
+
+    for backend in storage.BACKENDS:
+        for concurrency in sizes["concurrency"]:
+            with tempfile.TemporaryDirectory() as directory:
+                os.environ[webservice.STORAGE_ENV] = backend
+                os.environ[webservice.DB_PATH_ENV] = os.path.join(directory, storage.DEFAULT_PATHS[backend])
+                webservice._store = None
+                webservice._service_config = None
+                params = {"backend": backend, "concurrency": concurrency}
+                asyncio.run(_bench_webservice(results, webservice.app, documents, sizes, params))
+
+
+async def _bench_webservice(results, app, documents, sizes, params):
+    async with _client(app) as client:
+        epcs = []
+
+        async def ingest(document):
+            response = await client.post("/sanitise_xml_event/", content=document)
+            for event in response.json()["sanitised_events"]:
+                epcs.extend(event.get("epcList", []))
+            return response
+
+        (latencies, elapsed) = await _run_concurrently(
+            params["concurrency"], [lambda document=document: ingest(document) for document in documents])
+        _record(results, "webservice_ingest", dict(params, events_per_document=sizes["events"]),
+                events_per_second=len(documents) * sizes["events"] / elapsed, **_latency_metrics(latencies))
+
+        rand = random.Random(0)
+        lookups = [rand.choice(epcs)[len("ni:///"):] for _ in range(sizes["lookups"])]
+        (latencies, elapsed) = await _run_concurrently(
+            params["concurrency"], [lambda epc=epc: client.get("/events_for_epc/" + epc) for epc in lookups])
+        _record(results, "webservice_epc_lookup", dict(params, stored_events=len(documents) * sizes["events"]),
+                requests_per_second=len(lookups) / elapsed, **_latency_metrics(latencies))
+
+
+def bench_dead_drop(results, size, repeat):
+    """
+    Latency of polling the dead drop for single and batches of resources depending on the number of stored requests.
+    """
+    from dead_drop import dead_drop
+
+    sizes = SIZES["dead_drop"][size]
+    valid_until = (datetime.datetime.now() + datetime.timedelta(days=1)).strftime(dead_drop.DATE_FORMAT)
+    for request_count in sizes["requests"]:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dead_drop_db.json")
+            requestings = ["sha-256;{:064x}".format(i) for i in range(request_count)]
+            db = TinyDB(path)
+            db.insert_multiple([{"requesting": requesting, "recipient": {"endpoint": "https://one.example"},
+                                 "valid_until": valid_until} for requesting in requestings])
+            db.close()
+
+            os.environ[dead_drop.DB_PATH_ENV] = path
+            dead_drop._store = None
+            asyncio.run(_bench_dead_drop(results, dead_drop.app, requestings, sizes))
+
+
+async def _bench_dead_drop(results, app, requestings, sizes):
+    rand = random.Random(0)
+    params = {"stored_requests": len(requestings), "concurrency": sizes["concurrency"]}
+    async with _client(app) as client:
+        await client.get("/request/" + requestings[0])  # load the store
+
+        polls = [rand.choice(requestings) for _ in range(sizes["polls"])]
+        (latencies, elapsed) = await _run_concurrently(
+            sizes["concurrency"], [lambda requesting=requesting: client.get("/request/" + requesting)
+                                   for requesting in polls])
+        _record(results, "dead_drop_poll", params,
+                requests_per_second=len(polls) / elapsed, **_latency_metrics(latencies))
+
+        batches = [[rand.choice(requestings) for _ in range(100)] for _ in range(max(1, sizes["polls"] // 10))]
+        (latencies, elapsed) = await _run_concurrently(
+            sizes["concurrency"], [lambda batch=batch: client.post("/request/batch", json=batch) for batch in batches])
+        _record(results, "dead_drop_batch_poll", dict(params, batch_size=100),
+                requests_per_second=len(batches) / elapsed, **_latency_metrics(latencies))
+
+
+SUITES = {
+    "sanitiser": bench_sanitiser,
+    "cli": bench_cli,
+    "webservice": bench_webservice,
+    "dead_drop": bench_dead_drop
+}
+
+
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark")
+
+
+async def _run_concurrently(concurrency, requests):
+    """
+    Await all requests (functions returning an awaitable response) with concurrency requests in flight at a time.
+    Return the latency of each request and the total time in seconds.
+    """
+    latencies = []
+    pending = iter(requests)
+
+    async def worker():
+        for request in pending:
+            start = time.perf_counter()
+            response = await request()
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return (latencies, time.perf_counter() - start)
+
+
+def _latency_metrics(latencies):
+    latencies = sorted(latencies)
+    return {"latency_p50_ms": 1000 * _percentile(latencies, 50),
+            "latency_p95_ms": 1000 * _percentile(latencies, 95),
+            "latency_p99_ms": 1000 * _percentile(latencies, 99),
+            "latency_mean_ms": 1000 * statistics.mean(latencies)}
+
+
+def _percentile(sorted_values, percent):
+    """
+    Interpolate the percentile linearly between the closest ranks, like statistics.quantiles(method="inclusive"),
+    which needs Python 3.8.
+    """
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _record(results, benchmark, params, **metrics):
+    print("{} {}: {}".format(benchmark, params, ", ".join(
+        "{} {:.3f}".format(name, value) for (name, value) in metrics.items())), file=sys.stderr)
+    results.append({"benchmark": benchmark, "params": params, "metrics": metrics})
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current):
+    """
+    Print the relative change of every metric of the current results that is also in the baseline.
+    """
+    def key(result):
+        return (result["benchmark"], json.dumps(result["params"], sort_keys=True))
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    for result in current["results"]:
+        old = baseline_results.get(key(result))
+        if old is None:
+            continue
+        for (name, value) in result["metrics"].items():
+            if old["metrics"].get(name):
+                print("{} {} {}: {:.3f} -> {:.3f} ({:+.1f}%)".format(
+                    result["benchmark"], result["params"], name, old["metrics"][name], value,
+                    100 * (value / old["metrics"][name] - 1)), file=sys.stderr)
+
+
+def __command_line_parsing(argv):
+    logger_cfg = {
+        "format":
+            "%(asctime)s %(funcName)s (%(lineno)d) [%(levelname)s]:    %(message)s"
+    }
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the sanitiser, CLI, webservice and dead drop on synthetic EPCIS documents "
+                    "and write the results as JSON.")
+    parser.add_argument(
+        "suite",
+        help="Benchmark suites to run out of {}. Default: all.".format(", ".join(SUITES)),
+        nargs="*")
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="File to write the results to. Default: stdout.")
+    parser.add_argument(
+        "-c",
+        "--compare",
+        help="Results file of an earlier run (e.g. of another commit) to compare the results with.")
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        help="Number of runs of throughput benchmarks, of which the fastest is reported. Default: 3.",
+        type=int,
+        default=3)
+    parser.add_argument(
+        "-q",
+        "--quick",
+        help="Run with small sizes only, e.g. to check that the benchmarks work.",
+        action="store_true")
+    parser.add_argument(
+        "-l",
+        "--log",
+        help="Set the log level. Default: WARNING.",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="WARNING")
+
+    args = parser.parse_args(argv)
+
+    unknown_suites = set(args.suite) - set(SUITES)
+    if unknown_suites:
+        parser.error("Unknown benchmark suites: {}".format(", ".join(sorted(unknown_suites))))
+
+    logger_cfg["level"] = getattr(logging, args.log)
+    logging.basicConfig(**logger_cfg)
+
+    return args
+
+
+def main(argv):
+    args = __command_line_parsing(argv)
+    size = "quick" if args.quick else "full"
+
+    report = {
+        "commit": _git_commit(),
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "size": size,
+        "results": []
+    }
+    for suite in args.suite or list(SUITES):
+        print("Running {} benchmarks".format(suite), file=sys.stderr)
+        SUITES[suite](report["results"], size, args.repeat)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare(json.load(file), report)
+
+    return report
+
+
+# run benchmarks if run as main
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+"""
+
+.. module:: synthetic
+   :synopsis: Generators for synthetic EPCIS documents of configurable size and shape for benchmarking.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+import json
+import random
+
+EVENT_TYPES = ["ObjectEvent", "AggregationEvent", "TransformationEvent"]
+
+_BIZ_STEPS = ["commissioning", "packing", "shipping", "receiving", "storing"]
+_DISPOSITIONS = ["active", "in_progress", "in_transit", "in_stock"]
+
+
+def events(count, epcs_per_event=2, event_types=EVENT_TYPES, seed=0, distinct_epcs=None):
+    """
+    Generate count events as dicts in the EPCIS 2.0 JSON shape, cycling through the event_types.
+    EPCs are drawn from a pool of distinct_epcs (default: half the EPCs of all events), so some of them recur
+    like they do for objects moving through a supply chain. The same arguments always give the same events.
+    """
+    rand = random.Random(seed)
+    if distinct_epcs is None:
+        distinct_epcs = max(1, count * epcs_per_event // 2)
+
+    def epcs():
+        return ["urn:epc:id:sgtin:4012345.011111.{}".format(rand.randrange(distinct_epcs))
+                for _ in range(epcs_per_event)]
+
+    generated = []
+    for i in range(count):
+        event_type = event_types[i % len(event_types)]
+        event = {
+            "isA": event_type,
+            "eventTime": "2021-{:02d}-{:02d}T{:02d}:{:02d}:00.000+01:00".format(
+                1 + i % 12, 1 + i % 28, i % 24, i % 60),
+            "eventTimeZoneOffset": "+01:00"
+        }
+        if event_type == "ObjectEvent":
+            event["epcList"] = epcs()
+            event["action"] = "OBSERVE"
+        elif event_type == "AggregationEvent":
+            event["parentID"] = "urn:epc:id:sscc:4012345.{:010d}".format(rand.randrange(distinct_epcs))
+            event["childEPCs"] = epcs()
+            event["action"] = "ADD"
+        else:
+            event["inputEPCList"] = epcs()
+            event["outputEPCList"] = epcs()
+        event["bizStep"] = "urn:epcglobal:cbv:bizstep:" + rand.choice(_BIZ_STEPS)
+        event["disposition"] = "urn:epcglobal:cbv:disp:" + rand.choice(_DISPOSITIONS)
+        event["readPoint"] = {"id": "urn:epc:id:sgln:4012345.00001.{}".format(rand.randrange(10))}
+        event["bizTransactionList"] = [{"type": "urn:epcglobal:cbv:btt:po",
+                                        "bizTransaction": "urn:epc:id:gdti:4012345.00001.PO-{}".format(i // 10)}]
+        generated.append(event)
+    return generated
+
+
+def json_document(events):
+    """
+    Return an EPCIS 2.0 JSON-LD document (str) with the given events.
+    """
+    return json.dumps({
+        "@context": ["https://gs1.github.io/EPCIS/epcis-context.jsonld"],
+        "isA": "EPCISDocument",
+        "schemaVersion": 2.0,
+        "creationDate": "2021-01-01T00:00:00.000Z",
+        "epcisBody": {"eventList": events}
+    })
+
+
+def xml_document(events):
+    """
+    Return an EPCIS 1.2 XML document (str) with the given events.
+    """
+    parts = ['<?xml version="1.0"?>\n'
+             '<epcis:EPCISDocument xmlns:epcis="urn:epcglobal:epcis:xsd:1" schemaVersion="1.2" '
+             'creationDate="2021-01-01T00:00:00.000Z"><EPCISBody><EventList>']
+    for event in events:
+        event_type = event["isA"]
+        # 1.2 has no TransformationEvent element of its own, it is an extension
+        extension = event_type == "TransformationEvent"
+        if extension:
+            parts.append("<extension>")
+        parts.append("<{}>".format(event_type))
+        for (field, value) in event.items():
+            if field != "isA":
+                parts.append(_xml_field(field, value))
+        parts.append("</{}>".format(event_type))
+        if extension:
+            parts.append("</extension>")
+    parts.append("</EventList></EPCISBody></epcis:EPCISDocument>")
+    return "".join(parts)
+
+
+def _xml_field(field, value):
+    if field == "readPoint":
+        return "<readPoint><id>{}</id></readPoint>".format(value["id"])
+    if field == "bizTransactionList":
+        return "<bizTransactionList>{}</bizTransactionList>".format("".join(
+            '<bizTransaction type="{}">{}</bizTransaction>'.format(entry["type"], entry["bizTransaction"])
+            for entry in value))
+    if isinstance(value, list):
+        return "<{0}>{1}</{0}>".format(field, "".join("<epc>{}</epc>".format(epc) for epc in value))
+    return "<{0}>{1}</{0}>".format(field, value)
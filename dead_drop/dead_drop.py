@@ -18,31 +18,205 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
 file for details.
 
 """
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import logs
+from epcis_sanitiser import metrics
+
+from fastapi import FastAPI, HTTPException, Body, Query
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 import uvicorn
 import argparse
 import sys
+import asyncio
+import bisect
+import heapq
+import json
 import logging
+import math
+import os
+import threading
+import time
 
-from tinydb import TinyDB, Query
+from tinydb import TinyDB
 
 from datetime import datetime, timedelta
 
 DEFAULT_LIFETIME_IN_DAYS = 30
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+
+class RequestStore:
+    """
+    Persists requests in a TinyDB table, but serves all reads from memory:
+    The requests are kept by doc_id together with an index from the requesting value to the doc_ids
+    of all requests for it, so that looking up the requests for a resource is a point lookup.
+
+    Expiry times are kept as epoch seconds in a heap, so expired requests can be removed
+    without looking at any other request. Reads skip expired requests that are not removed yet.
+    The sorted list of all doc_ids serves as cursor for paging through the requests.
+    Reads take the lock of the writers, since the reaper removes requests from another thread.
+    """
+
+    def __init__(self, path):
+        self._db = TinyDB(path)
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._index = {}
+        self._expires_at = {}
+        self._expiry_queue = []
+        self._doc_ids = []
+        for document in self._db.all():
+            self._add(document.doc_id, dict(document))
+
+    def _add(self, doc_id, request):
+        expires_at = math.inf
+        if "valid_until" in request:
+            expires_at = datetime.strptime(request["valid_until"], DATE_FORMAT).timestamp()
+
+        self._requests[doc_id] = request
+        self._doc_ids.append(doc_id)  # TinyDB hands out increasing doc_ids
+        self._index.setdefault(request["requesting"], set()).add(doc_id)
+        self._expires_at[doc_id] = expires_at
+        heapq.heappush(self._expiry_queue, (expires_at, doc_id))
+
+    def insert(self, request):
+        with self._lock:
+            self._add(self._db.insert(request), request)
+
+    def find(self, requesting, now=None):
+        """
+        Return all requests for requesting that are not expired at now (default: the current time).
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return self._find(requesting, now)
+
+    def _find(self, requesting, now):
+        return [self._requests[doc_id] for doc_id in sorted(self._index.get(requesting, ()))
+                if self._expires_at[doc_id] >= now]
+
+    def find_many(self, requestings, now=None):
+        """
+        Return a dict mapping each of the requestings with requests not expired at now to these requests.
+        Costs a dict lookup per requesting, independent of the number of stored requests.
+        """
+        if now is None:
+            now = time.time()
+        found = {}
+        with self._lock:
+            for requesting in set(requestings):
+                matches = self._find(requesting, now)
+                if matches:
+                    found[requesting] = matches
+        return found
+
+    def __len__(self):
+        with self._lock:
+            return len(self._requests)
+
+    def all(self, now=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return [request for (doc_id, request) in self._requests.items() if self._expires_at[doc_id] >= now]
+
+    def page(self, cursor=0, limit=1000, now=None):
+        """
+        Return up to limit pairs (doc_id, request) of the requests stored after the one with doc_id cursor
+        that are not expired at now, ordered by doc_id.
+        """
+        if now is None:
+            now = time.time()
+        page = []
+        with self._lock:
+            for i in range(bisect.bisect_right(self._doc_ids, cursor), len(self._doc_ids)):
+                if len(page) == limit:
+                    break
+                doc_id = self._doc_ids[i]
+                if self._expires_at[doc_id] >= now:
+                    page.append((doc_id, self._requests[doc_id]))
+        return page
+
+    def remove_expired(self, now=None):
+        """
+        Remove all requests expired at now (default: the current time) and return their doc_ids.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            doc_ids = []
+            while self._expiry_queue and self._expiry_queue[0][0] < now:
+                doc_ids.append(heapq.heappop(self._expiry_queue)[1])
+            if doc_ids:
+                self._db.remove(doc_ids=doc_ids)
+                removed = set(doc_ids)
+                self._doc_ids = [doc_id for doc_id in self._doc_ids if doc_id not in removed]
+            for doc_id in doc_ids:
+                request = self._requests.pop(doc_id)
+                del self._expires_at[doc_id]
+                matches = self._index[request["requesting"]]
+                matches.discard(doc_id)
+                if not matches:
+                    del self._index[request["requesting"]]
+        return doc_ids
+
+
+DB_PATH_ENV = "DEAD_DROP_DB"
+REAP_INTERVAL_ENV = "DEAD_DROP_REAP_INTERVAL"
+METRICS_ENV = "DEAD_DROP_METRICS"
+DEFAULT_REAP_INTERVAL_IN_SECONDS = 60
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_PAGE_SIZE = 1000
+
 app = FastAPI()
-db = TinyDB('dead_drop_db.json')
+_store = None
+_store_lock = threading.Lock()
+
+# Recorded only if the dead drop runs with --metrics, see the metrics module
+REGISTRY = metrics.Registry()
+LOOKUPS = metrics.Counter("dead_drop_lookups_total",
+                          "Number of resources looked up by outcome: hit if anybody requests them, miss otherwise.",
+                          ["outcome"], REGISTRY)
+EXPIRED_REQUESTS = metrics.Counter("dead_drop_expired_requests_total", "Number of expired requests removed.",
+                                   registry=REGISTRY)
+HTTP_REQUESTS, HTTP_REQUEST_SECONDS = metrics.request_metrics("dead_drop", REGISTRY)
+metrics.FunctionMetric("dead_drop_stored_requests", "Number of requests in the store, including expired ones "
+                       "not removed yet.", lambda: len(__store()), registry=REGISTRY)
+metrics.FunctionMetric("dead_drop_lookup_hit_ratio", "Share of looked up resources that anybody requests.",
+                       lambda: metrics.ratio(LOOKUPS.value("hit"), LOOKUPS.value("hit") + LOOKUPS.value("miss")),
+                       registry=REGISTRY)
+app.add_middleware(metrics.RequestMetrics, requests=HTTP_REQUESTS, seconds=HTTP_REQUEST_SECONDS)
+
+
+@app.on_event("startup")
+def enable_metrics():
+    REGISTRY.enabled = json.loads(os.environ.get(METRICS_ENV, "false"))
+
+
+@app.on_event("startup")
+async def start_reaper():
+    interval = float(os.environ.get(REAP_INTERVAL_ENV, DEFAULT_REAP_INTERVAL_IN_SECONDS))
+    app.state.reaper = asyncio.create_task(__reap_expired_requests(interval))
+
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    app.state.reaper.cancel()
 
 
 class Adress(BaseModel):
     endpoint: str
-    protocol: Optional[str]
+    protocol: Optional[str] = None
 
     def asdict(self):
         re = {"endpoint": self.endpoint}
@@ -53,7 +227,7 @@ class Adress(BaseModel):
 
 class Authorisation(BaseModel):
     id: str
-    credentials: Optional[dict]
+    credentials: Optional[dict] = None
 
     def asdict(self):
         re = {"id": self.id}
@@ -65,8 +239,8 @@ class Authorisation(BaseModel):
 class Request(BaseModel):
     requesting: str
     recipient: Adress
-    auth: Optional[Authorisation]
-    valid_until: Optional[datetime]
+    auth: Optional[Authorisation] = None
+    valid_until: Optional[datetime] = None
 
     def asdict(self):
         re = {"requesting": self.requesting,
@@ -89,16 +263,16 @@ def redirect_to_docs():
 def store_request(request: Request) -> str:
     if not request.valid_until:
         request.valid_until = datetime.now() + timedelta(days=DEFAULT_LIFETIME_IN_DAYS)
-    db.insert(request.asdict())
+    __store().insert(request.asdict())
     return "Request stored"
 
 
 @app.get("/request/{requesting}")
 def find_request(requesting: str) -> List[Request]:
-    __remove_old_requests()
     logging.debug("looking for '%s'", requesting)
-    matches = db.search(Query().requesting == requesting)
-    logging.debug("found %s", matches)
+    matches = __store().find(requesting)
+    logs.dump_payload(matches, "found")
+    LOOKUPS.labels("hit" if matches else "miss").inc()
     if matches:
         return matches
 
@@ -106,19 +280,83 @@ def find_request(requesting: str) -> List[Request]:
         status_code=404, detail="No requests requesting '{}' found".format(requesting))
 
 
+@app.post("/request/batch")
+def find_requests(requestings: List[str] = Body(...)) -> Dict[str, List[Request]]:
+    """Takes a list of requested resources (e.g. all event hashes of a data owner) and returns the pending requests
+    for those of them that are requested by anyone, keyed by the requested resource. Resources without requests
+    are left out, so the response is empty if nobody requests any of them.
+    """
+    start = time.perf_counter()
+    found = __store().find_many(requestings)
+    LOOKUPS.labels("hit").inc(len(found))
+    LOOKUPS.labels("miss").inc(len(set(requestings)) - len(found))
+    logs.summary("Looked up batch", logging.DEBUG, resources=len(requestings), requested=len(found),
+                 seconds=time.perf_counter() - start)
+    return found
+
+
 @app.get("/request")
-def find_all_requests() -> List[Request]:
-    """Return all requests. Caution: A production implementation might not want
+def find_all_requests(cursor: int = 0, limit: Optional[int] = Query(None, ge=1), ndjson: bool = False
+                      ) -> List[Request]:
+    """Return all requests stored after the cursor. Caution: A production implementation might not want
     to offer this functionality as it potentially exposes all requesting parties.
+    With a limit, at most limit requests are returned and the cursor of the next page is sent
+    in the X-Next-Cursor header, which is missing on the last page.
+    With ndjson, the requests are streamed as newline delimited JSON instead.
     """
-    __remove_old_requests()
-    return db.all()
+    if ndjson:
+        return StreamingResponse(__ndjson_requests(cursor), media_type="application/x-ndjson")
+    if limit is None and not cursor:
+        return __store().all()
+    page = __store().page(cursor, limit or math.inf)
+    headers = {}
+    if limit and len(page) == limit:
+        headers[NEXT_CURSOR_HEADER] = str(page[-1][0])
+    return JSONResponse([request for (_, request) in page], headers=headers)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Get the metrics of the dead drop in the Prometheus text format: Durations of requests, the number of
+    stored requests and the share of looked up resources that anybody requests. Requires running with --metrics.
+    """
+    if not REGISTRY.enabled:
+        raise HTTPException(
+            status_code=404, detail="Metrics are disabled, run the dead drop with --metrics")
+    return Response(REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def __store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RequestStore(os.environ.get(DB_PATH_ENV, "dead_drop_db.json"))
+    return _store
 
 
-def __remove_old_requests():
-    removed = db.remove(Query().valid_until.test(
-        lambda valid: datetime.strptime(valid, DATE_FORMAT) < datetime.now()))
-    logging.debug("removed old requests: %s", removed)
+def __ndjson_requests(cursor):
+    while True:
+        page = __store().page(cursor, NDJSON_PAGE_SIZE)
+        for (cursor, request) in page:
+            yield json.dumps(request) + "\n"
+        if len(page) < NDJSON_PAGE_SIZE:
+            return
+
+
+async def __reap_expired_requests(interval):
+    """
+    Remove expired requests from the store every interval seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # removing writes the database file, which must not block the event loop
+            removed = await run_in_threadpool(__store().remove_expired)
+            EXPIRED_REQUESTS.labels().inc(len(removed))
+            logging.debug("removed old requests: %s", removed)
+        except Exception:
+            logging.exception("Failed to remove old requests")
 
 
 def __command_line_parsing(argv):
@@ -136,6 +374,35 @@ def __command_line_parsing(argv):
         help="Set the log level. Default: INFO.",
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         default="INFO")
+    parser.add_argument(
+        "-L",
+        "--log-format",
+        help="Format of log records: text, or one JSON object per line. Default: text.",
+        choices=logs.LOG_FORMATS,
+        default="text")
+    parser.add_argument(
+        "--payload-sample-rate",
+        help="Share (0 to 1) of payload dumps, i.e. log records with whole documents or events, "
+             "that are logged. Default: {}.".format(logs.DEFAULT_PAYLOAD_SAMPLE_RATE),
+        type=float,
+        default=logs.DEFAULT_PAYLOAD_SAMPLE_RATE)
+    parser.add_argument(
+        "--db",
+        help="Path of the database file.",
+        default="dead_drop_db.json"
+    )
+    parser.add_argument(
+        "--reap-interval",
+        help="Seconds between two runs of the removal of expired requests.",
+        type=float,
+        default=DEFAULT_REAP_INTERVAL_IN_SECONDS
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        help="Record metrics and serve them at /metrics in the Prometheus text format.",
+        action="store_true",
+        default=False)
     parser.add_argument(
         "-H",
         "--host",
@@ -163,7 +430,8 @@ def __command_line_parsing(argv):
     args = parser.parse_args(argv)
 
     logger_cfg["level"] = getattr(logging, args.log)
-    logging.basicConfig(**logger_cfg)
+    logs.basic_config(args.log_format, **logger_cfg)
+    logs.set_payload_sample_rate(args.payload_sample_rate)
     logging.debug("Setting log level: %s(%s)", args.log, logger_cfg["level"])
 
     # print("Log messages above level: {}".format(logger_cfg["level"]))
@@ -175,6 +443,10 @@ def main(argv):
 
     args = vars(__command_line_parsing(argv))
 
+    os.environ[DB_PATH_ENV] = args["db"]
+    os.environ[REAP_INTERVAL_ENV] = str(args["reap_interval"])
+    os.environ[METRICS_ENV] = json.dumps(args["metrics"])
+
     uvicorn_args = {"host": args["host"],
                     "port": int(args["port"]),
                     "log_level": args["log"].lower(),
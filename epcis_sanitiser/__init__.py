@@ -9,9 +9,12 @@ If including an element with children, all children are hashed separately.
 
 This is the default used. Run the cli tool with '-c some_config.json' to load other values,
  in particular in order to set salts.
+
+The hash_cache_size is the maximal number of salted hashes memoised, see sanitiser.set_hash_cache_size.
 """
 DEFAULT_CONFIG = {
     "dead_drop_url": "https://discovery.epcat.de/dead_drop",
+    "hash_cache_size": 65536,
     "sanitised_fields": {
         "eventType": None,
         "eventId": None,
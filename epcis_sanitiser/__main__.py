@@ -24,15 +24,33 @@ try:
 except ImportError:
     from context import epcis_sanitiser  # noqa: F401
 
+from epcis_sanitiser import logs
+from epcis_sanitiser import output
+from epcis_sanitiser import reader
 from epcis_sanitiser import sanitiser
 
 
 import argparse
+import collections
+import contextlib
+import itertools
 import json
 import logging
 import os
 import sys
-from epcis_event_hash_generator import events_from_file_reader
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor
+
+# Files larger than this are parsed once and their events are sanitised in chunks by all processes of the pool.
+SPLIT_FILE_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1000
+
+# The sanitisation plan of the current (worker) process, see _init_plan
+_plan = None
+
+# Errors of reading a malformed file, see reader.iter_events
+_READ_ERRORS = (ElementTree.ParseError, ValueError)
 
 
 def __command_line_parsing(argv):
@@ -43,7 +61,11 @@ def __command_line_parsing(argv):
 
     parser = argparse.ArgumentParser(
         description="Generate a sanitised EPCIS event from an EPCIS Document.")
-    parser.add_argument("file", help="EPCIS file", nargs="+")
+    parser.add_argument(
+        "file",
+        help="EPCIS files (.xml, .json or .jsonld), directories to sanitise all EPCIS files below "
+             "or glob patterns like 'archive/**/*.xml'.",
+        nargs="+")
     parser.add_argument(
         "-a",
         "--algorithm",
@@ -56,12 +78,36 @@ def __command_line_parsing(argv):
         help="Set the log level. Default: INFO.",
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         default="WARNING")
+    parser.add_argument(
+        "-L",
+        "--log-format",
+        help="Format of log records: text, or one JSON object per line. Default: text.",
+        choices=logs.LOG_FORMATS,
+        default="text")
+    parser.add_argument(
+        "--payload-sample-rate",
+        help="Share (0 to 1) of payload dumps, i.e. log records with whole documents or events, "
+             "that are logged. Default: {}.".format(logs.DEFAULT_PAYLOAD_SAMPLE_RATE),
+        type=float,
+        default=logs.DEFAULT_PAYLOAD_SAMPLE_RATE)
     parser.add_argument(
         "-b",
         "--batch",
         help="If given, write the output for each input file into a sibling output file "
-             "with the same name as the input file but file ending '.sanitised.json' instead of stdout.",
+             "with the same name as the input file but file ending '.sanitised.json' "
+             "(or '.sanitised.ndjson') instead of stdout.",
         action="store_true")
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="File to write the sanitised events of all input files to. Default: stdout.")
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format: a JSON array of the sanitised events, or newline delimited JSON "
+             "with one event per line. Default: json.",
+        choices=output.OUTPUT_FORMATS,
+        default="json")
     parser.add_argument(
         "-d",
         "--dead-drop-url",
@@ -75,24 +121,168 @@ def __command_line_parsing(argv):
         " Set the salt to empty string for unsalted hashing " +
         "and to None for including the clear text value without hashing"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to sanitise files in parallel. Default: 1.",
+        type=int,
+        default=1)
 
     args = parser.parse_args(argv)
 
+    if args.batch and args.output:
+        parser.error("Use either an output file or batch mode.")
+
     logger_cfg["level"] = getattr(logging, args.log)
-    logging.basicConfig(**logger_cfg)
+    logs.basic_config(args.log_format, **logger_cfg)
+    logs.set_payload_sample_rate(args.payload_sample_rate)
 
     # print("Log messages above level: {}".format(logger_cfg["level"]))
 
+    # outputs of earlier runs in batch mode are no inputs
+    args.file = reader.expand_paths(args.file, output.FILE_ENDINGS.values())
     if not args.file:
         logging.critical("File name required.")
         parser.print_help()
         sys.exit(1)
     else:
-        logging.debug("reading from files: '{}'".format(args.file))
+        logging.debug("reading from files: '%s'", args.file)
 
     return args
 
 
+def _init_plan(config, hashalg, dead_drop_url):
+    global _plan
+    _plan = sanitiser.compile_plan(config, hashalg, dead_drop_url)
+
+
+def _read_events(filename):
+    """
+    Yield the events of the file as they are parsed. The error of a malformed file is logged and raised again.
+    """
+    count = 0
+    try:
+        for event in reader.iter_events(filename):
+            count += 1
+            yield event
+    except _READ_ERRORS as ex:
+        logging.error("Could not read '%s' after %s events: %s", filename, count, ex)
+        raise
+
+
+def _sanitise_file(filename):
+    return list(_iter_sanitise_file(filename))
+
+
+def _iter_sanitise_file(filename):
+    """
+    Yield the sanitised events of the file, sanitising CHUNK_SIZE events at a time.
+    """
+    start = time.perf_counter()
+    count = 0
+    for sanitised_event in sanitiser.iter_sanitise_events(_read_events(filename), plan=_plan,
+                                                          batch_size=CHUNK_SIZE):
+        count += 1
+        yield sanitised_event
+    logs.summary("Sanitised file", file=filename, events=count, bytes=os.path.getsize(filename),
+                 seconds=time.perf_counter() - start)
+
+
+def _sanitise_chunk(events):
+    return sanitiser.sanitise_events(events=("EventList", "", events), dead_drop_url=None, plan=_plan)
+
+
+def _sanitise_files_in_parallel(filenames, pool, jobs):
+    """
+    Sanitise all files in the pool and yield (filename, sanitised_events) in the order of filenames.
+    Only a few files ahead of the one yielded next are processed at a time to bound memory usage.
+    Large files are split into chunks of events that are sanitised in parallel, see _sanitise_split_file.
+    """
+    pending = collections.deque()
+
+    for filename in filenames:
+        if os.path.getsize(filename) > SPLIT_FILE_SIZE:
+            while pending:
+                yield _collect(pending)
+            yield filename, _sanitise_split_file(filename, pool, jobs)
+            continue
+        pending.append((filename, pool.submit(_sanitise_file, filename)))
+
+        while len(pending) > 2 * jobs:
+            yield _collect(pending)
+
+    while pending:
+        yield _collect(pending)
+
+
+def _collect(pending):
+    filename, future = pending.popleft()
+    return filename, _result(future)
+
+
+def _result(future):
+    # the error of a malformed file is raised while its events are written, see _write_output
+    yield from future.result()
+
+
+def _sanitise_split_file(filename, pool, jobs):
+    """
+    Yield the sanitised events of the file, whose events are sanitised in chunks of CHUNK_SIZE by the pool.
+    The file is read only as far as needed to keep 2 * jobs chunks in flight, and the sanitised events of each
+    chunk are yielded in order once it is done.
+    """
+    start = time.perf_counter()
+    events = _read_events(filename)
+    pending = collections.deque()
+    chunks = 0
+    for chunk in iter(lambda: list(itertools.islice(events, CHUNK_SIZE)), []):
+        if len(pending) == 2 * jobs:
+            yield from pending.popleft().result()
+        pending.append(pool.submit(_sanitise_chunk, chunk))
+        chunks += 1
+    while pending:
+        yield from pending.popleft().result()
+    logs.summary("Sanitised split file", file=filename, bytes=os.path.getsize(filename), chunks=chunks,
+                 seconds=time.perf_counter() - start)
+
+
+def _write_output(results, output_format, batch, output_path=None):
+    """
+    Write the sanitised events of each (filename, sanitised_events) in results as soon as it is available:
+    In batch mode into a sibling file of the input file, otherwise all into the output file or stdout.
+    Return the names of the files that could not be read. In batch mode, their partial output is removed.
+    In a single output, the events of such a file written so far cannot be taken back, so a JSON array is left
+    incomplete, as EventWriter does on errors, to not be mistaken for a complete one.
+    """
+    failed = []
+    if batch:
+        for filename, sanitised_events in results:
+            path = os.path.splitext(filename)[0] + output.FILE_ENDINGS[output_format]
+            try:
+                with open(path, 'w', encoding='utf-8') as outfile, \
+                        output.EventWriter(outfile, output_format) as writer:
+                    writer.write_many(sanitised_events)
+            except _READ_ERRORS:
+                failed.append(filename)
+                os.remove(path)
+        return failed
+
+    with contextlib.ExitStack() as stack:
+        outfile = stack.enter_context(open(output_path, 'w', encoding='utf-8')) if output_path else sys.stdout
+        writer = output.EventWriter(outfile, output_format)
+        try:
+            for filename, sanitised_events in results:
+                try:
+                    writer.write_many(sanitised_events)
+                except _READ_ERRORS:
+                    failed.append(filename)
+        finally:
+            writer.flush()
+        if not failed:
+            writer.close()
+    return failed
+
+
 def main(argv):
     """The main function reads the path to the epcis file
     and optionaly the hash algorithm from the command
@@ -104,29 +294,27 @@ def main(argv):
     # Never log anything before calling logging.basicConfig !
     logging.debug("Running cli tool with arguments %s", argv)
 
-    for filename in args.file:
-        events = events_from_file_reader.event_list_from_file(filename)
-
-        logging.debug(
-            "\n\nEvents contained in '{}':\n{}".format(filename, events))
+    config = epcis_sanitiser.DEFAULT_CONFIG
 
-        config = epcis_sanitiser.DEFAULT_CONFIG
+    if args.sanitisation_config_file:
+        with open(args.sanitisation_config_file, 'r') as file:
+            data = file.read()
+        config = json.loads(data)
 
-        if args.sanitisation_config_file:
-            with open(args.sanitisation_config_file, 'r') as file:
-                data = file.read()
-            config = json.loads(data)
+    plan_args = (config, args.algorithm, args.dead_drop_url)
 
-        sanitised_events = sanitiser.sanitise_events(
-            events=events, hashalg=args.algorithm, dead_drop_url=args.dead_drop_url, config=config)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_plan, initargs=plan_args) as pool:
+            failed = _write_output(_sanitise_files_in_parallel(reader.prefetched(args.file), pool, args.jobs),
+                                   args.format, args.batch, args.output)
+    else:
+        _init_plan(*plan_args)
+        failed = _write_output(((filename, _iter_sanitise_file(filename)) for filename in reader.prefetched(args.file)),
+                               args.format, args.batch, args.output)
 
-        if args.batch:
-            with open(os.path.splitext(filename)[0] + '.sanitised.json', 'w') as outfile:
-                outfile.write("\n".join([str(event) for event in sanitised_events]) + "\n")
-        else:
-            print("\n[\n")
-            print(",\n".join([str(event).replace("'", '"') for event in sanitised_events]))
-            print("\n]\n")
+    if failed:
+        logging.critical("Could not sanitise %s of %s files: %s", len(failed), len(args.file), failed)
+        sys.exit(1)
 
 
 # goto main if script is run as entrypoint
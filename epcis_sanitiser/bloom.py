@@ -0,0 +1,54 @@
+"""
+
+.. module:: bloom
+   :synopsis: A simple Bloom filter to tell cheaply that a value was never seen before.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Set of strings or bytes that may answer 'in' wrongly with True (with probability error_rate as long as no more than
+    capacity values are added), but never wrongly with False.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.count = 0
+        self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, value):
+        # double hashing: k positions from two independent 64 bit hashes
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        digest = hashlib.blake2b(value, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._size for i in range(self._hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
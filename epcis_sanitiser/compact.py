@@ -0,0 +1,196 @@
+"""
+
+.. module:: compact
+   :synopsis: Compact binary encoding of sanitised events for storage.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+Named identifiers of hashes ('ni:///sha-256;<hex>' plus an optional query like '?ver=CBV2.0') are stored
+as an algorithm code and the raw digest, followed by the dictionary id of the query.
+Field names and the values of the DICTIONARY_FIELDS are stored as dictionary ids as well.
+The dictionary is passed in by the caller and has to map strings to small positive ints and back:
+
+    dictionary.id_of(string, add) -> int, or None if the string is unknown and add is False
+    dictionary.string_of(id) -> str
+
+Encoded event:  varint(number of fields) (varint(field name id) value)*
+Encoded value:  _PLAIN varint(length) utf-8
+              | _DICTIONARY varint(id)
+              | _HASH algorithm code, digest, varint(query id)
+              | _LIST varint(length) value*
+              | _NONE
+              | _JSON varint(length) utf-8 of the JSON representation of anything else
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+import hashlib
+import json
+
+from epcis_sanitiser.sanitiser import NI_PREFIXES
+
+# Fields whose values repeat across many events, e.g. the dead drop URL or business steps in clear text
+DICTIONARY_FIELDS = {"request_event_data_at", "eventType", "action", "bizStep", "disposition"}
+
+_PLAIN, _DICTIONARY, _HASH, _LIST, _NONE, _JSON = range(6)
+
+# (algorithm code, ni prefix, number of hex digits of the digest), the codes must never change
+_HASH_PREFIXES = [(code, NI_PREFIXES[hashalg], 2 * hashlib.new(hashalg).digest_size)
+                  for (code, hashalg) in enumerate(["sha256", "sha3_256", "sha384", "sha512"], 1)]
+_CODE_TO_PREFIX = {code: (prefix, hex_digits // 2) for (code, prefix, hex_digits) in _HASH_PREFIXES}
+
+
+def encode_event(event, dictionary):
+    """
+    Encode the sanitised event (a dict) as bytes, adding new strings to the dictionary.
+    """
+    out = bytearray()
+    _write_varint(out, len(event))
+    for (field, value) in event.items():
+        _write_varint(out, dictionary.id_of(field, True))
+        _encode_value(value, out, dictionary, field in DICTIONARY_FIELDS)
+    return bytes(out)
+
+
+def decode_event(data, dictionary):
+    """
+    Decode bytes from encode_event back to the sanitised event, with all hashes as named identifiers again.
+    """
+    event = {}
+    (count, pos) = _read_varint(data, 0)
+    for _ in range(count):
+        (field_id, pos) = _read_varint(data, pos)
+        (event[dictionary.string_of(field_id)], pos) = _decode_value(data, pos, dictionary)
+    return event
+
+
+def encode_key(value, dictionary, add=True):
+    """
+    Encode a single string, e.g. an eventId or EPC, to bytes for an index. Equal strings get equal keys.
+    Returns None if add is False and the key would need a new dictionary entry, i.e. no such key was stored yet.
+    """
+    hash = _split_hash(value)
+    if hash is None:
+        return bytes([_PLAIN]) + value.encode('utf-8')
+    (code, digest, query) = hash
+    query_id = dictionary.id_of(query, add)
+    if query_id is None:
+        return None
+    out = bytearray([_HASH, code])
+    out += digest
+    _write_varint(out, query_id)
+    return bytes(out)
+
+
+def _split_hash(value):
+    """
+    Return (algorithm code, digest, query) if the value is the named identifier of a hash, None otherwise.
+    """
+    if not value.startswith("ni:///"):
+        return None
+    for (code, prefix, hex_digits) in _HASH_PREFIXES:
+        if value.startswith(prefix):
+            start = len(prefix)
+            hex_digest = value[start:start + hex_digits]
+            try:
+                digest = bytes.fromhex(hex_digest)
+            except ValueError:
+                return None
+            # only lower case hex without whitespace can be restored exactly
+            if len(digest) * 2 != hex_digits or digest.hex() != hex_digest:
+                return None
+            return (code, digest, value[start + hex_digits:])
+    return None
+
+
+def _encode_value(value, out, dictionary, dictionary_encoded):
+    if isinstance(value, str):
+        hash = _split_hash(value)
+        if hash is not None:
+            (code, digest, query) = hash
+            out.append(_HASH)
+            out.append(code)
+            out += digest
+            _write_varint(out, dictionary.id_of(query, True))
+        elif dictionary_encoded:
+            out.append(_DICTIONARY)
+            _write_varint(out, dictionary.id_of(value, True))
+        else:
+            _write_text(out, _PLAIN, value)
+    elif isinstance(value, list):
+        out.append(_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode_value(item, out, dictionary, dictionary_encoded)
+    elif value is None:
+        out.append(_NONE)
+    else:
+        _write_text(out, _JSON, json.dumps(value))
+
+
+def _decode_value(data, pos, dictionary):
+    tag = data[pos]
+    pos += 1
+    if tag == _HASH:
+        (prefix, digest_size) = _CODE_TO_PREFIX[data[pos]]
+        digest = data[pos + 1:pos + 1 + digest_size]
+        (query_id, pos) = _read_varint(data, pos + 1 + digest_size)
+        return (prefix + digest.hex() + dictionary.string_of(query_id), pos)
+    if tag == _DICTIONARY:
+        (id, pos) = _read_varint(data, pos)
+        return (dictionary.string_of(id), pos)
+    if tag == _LIST:
+        (length, pos) = _read_varint(data, pos)
+        values = []
+        for _ in range(length):
+            (value, pos) = _decode_value(data, pos, dictionary)
+            values.append(value)
+        return (values, pos)
+    if tag == _NONE:
+        return (None, pos)
+    (length, pos) = _read_varint(data, pos)
+    text = data[pos:pos + length].decode('utf-8')
+    if tag == _JSON:
+        return (json.loads(text), pos + length)
+    return (text, pos + length)
+
+
+def _write_text(out, tag, text):
+    data = text.encode('utf-8')
+    out.append(tag)
+    _write_varint(out, len(data))
+    out += data
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value, pos)
+        shift += 7
@@ -0,0 +1,80 @@
+"""
+
+.. module:: epc_index
+   :synopsis: Inverted index from hashed EPCs to the sanitised events referencing them.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+# Fields of a sanitised event that may contain a (hashed) EPC.
+# All of them are lists of values, except for the parentID, which is a single value.
+EPC_FIELDS = [
+    "epcList",
+    "inputEPCList",
+    "outputEPCList",
+    "childEPCs",
+    "parentID",
+    "quantityList",
+    "childQuantityList",
+    "inputQuantityList",
+    "outputQuantityList"
+]
+
+
+def epcs_of_event(event):
+    """
+    Return the set of all values in the EPC fields of the given sanitised event.
+    """
+    epcs = set()
+    for field in EPC_FIELDS:
+        value = event.get(field)
+        if not value:
+            continue
+        if isinstance(value, list):
+            epcs.update(value)
+        else:
+            epcs.add(value)
+    return epcs
+
+
+class EpcIndex:
+    """
+    Maps every value found in the EPC fields of a sanitised event to the ids of all events containing it.
+    Ids are kept in insertion order and each id is recorded at most once per value,
+    so a lookup costs O(matches) and returns no duplicates.
+    """
+
+    def __init__(self):
+        self._index = {}
+
+    def add(self, event_id, event):
+        for epc in epcs_of_event(event):
+            self._index.setdefault(epc, []).append(event_id)
+
+    def lookup(self, epc):
+        return list(self._index.get(epc, []))
+
+    def __len__(self):
+        return len(self._index)
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        Build the index from TinyDB documents, using the doc_id as event id.
+        """
+        index = cls()
+        for document in documents:
+            index.add(document.doc_id, document)
+        return index
@@ -0,0 +1,145 @@
+"""
+
+.. module:: logs
+   :synopsis: Log configuration with an optional JSON format, document summaries and sampled payload dumps.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+Hot paths log a summary per document (event count, bytes, durations) instead of the document itself.
+Whole payloads are only dumped at DEBUG level for a sample of the calls to dump_payload. The same sample rate
+applies to the records below WARNING of the hash generator, which logs every parsed event.
+Nothing is formatted unless the record is emitted.
+
+"""
+
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+
+import epcis_event_hash_generator
+
+LOG_FORMATS = ["text", "json"]
+DEFAULT_PAYLOAD_SAMPLE_RATE = 0.01
+
+_payload_sample_rate = DEFAULT_PAYLOAD_SAMPLE_RATE
+_HASH_GENERATOR_DIR = os.path.dirname(epcis_event_hash_generator.__file__)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single line JSON object. The fields of summaries become keys of their own.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "function": record.funcName,
+            "line": record.lineno
+        }
+        fields = getattr(record, "fields", None)
+        if fields is None:
+            entry["message"] = record.getMessage()
+        else:
+            entry["message"] = record.summary
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Fields:
+    """
+    Renders the fields of a summary as 'name=value' pairs once a text formatter asks for them.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join("{}={}".format(name, _format_field(value)) for (name, value) in self.fields.items())
+
+
+def _format_field(value):
+    return "{:.6f}".format(value) if isinstance(value, float) else str(value)
+
+
+class _HashGeneratorSample(logging.Filter):
+    """
+    Lets through a sample of the records below WARNING that the hash generator logs to the root logger.
+    """
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not record.pathname.startswith(_HASH_GENERATOR_DIR):
+            return True
+        return random.random() < _payload_sample_rate
+
+
+_HASH_GENERATOR_SAMPLE = _HashGeneratorSample()
+
+
+def basic_config(log_format="text", **kwargs):
+    """
+    Like logging.basicConfig, with log_format "json" writing records as JSON objects instead of using
+    the format given in kwargs.
+    """
+    if log_format == "json":
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        kwargs.pop("format", None)
+        kwargs["handlers"] = [handler]
+    logging.basicConfig(**kwargs)
+    logging.getLogger().addFilter(_HASH_GENERATOR_SAMPLE)
+
+
+def set_payload_sample_rate(rate):
+    """
+    Set the share (0 to 1) of calls to dump_payload that log their payload, if DEBUG is enabled,
+    and of the records below WARNING of the hash generator that are logged.
+    """
+    global _payload_sample_rate
+    _payload_sample_rate = rate
+
+
+def summary(message, level=logging.INFO, **fields):
+    """
+    Log message with the fields, e.g. the number of events, bytes and seconds it took to process a document.
+    """
+    if logging.getLogger().isEnabledFor(level):
+        _log_for_caller(level, "%s: %s", (message, _Fields(fields)), extra={"summary": message, "fields": fields})
+
+
+def dump_payload(payload, message, *args):
+    """
+    Log the message (formatted with args like logging.debug does) followed by the payload at DEBUG level,
+    for a sample of the calls only.
+    """
+    if _payload_sample_rate and logging.getLogger().isEnabledFor(logging.DEBUG) \
+            and random.random() < _payload_sample_rate:
+        _log_for_caller(logging.DEBUG, message + ": %s", args + (payload,))
+
+
+def _log_for_caller(level, message, args, extra=None):
+    """
+    Log with the function and line of the caller of summary or dump_payload instead of those in this module,
+    like the stacklevel argument of Python 3.8 does.
+    """
+    root = logging.getLogger()
+    frame = sys._getframe(2)
+    record = root.makeRecord(root.name, level, frame.f_code.co_filename, frame.f_lineno, message, args, None,
+                             frame.f_code.co_name, extra)
+    root.handle(record)
@@ -0,0 +1,295 @@
+"""
+
+.. module:: metrics
+   :synopsis: Counters and histograms exposed in the Prometheus text format.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+Metrics belong to a Registry, which is disabled until a service enables it. While disabled, labels() hands out
+a shared object that ignores all updates, so instrumented code costs a function call per hook and nothing else.
+Values that are cheap to read anyway, like the size of a store, are FunctionMetrics evaluated on render only.
+
+"""
+
+import bisect
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# in seconds, from a fraction of a millisecond for a single stage to several seconds for a large request
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """
+    The metrics of a service, rendered all at once for a scrape.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            lines += metric.samples()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Ignored:
+    """
+    Stands in for the labelled child of a metric of a disabled registry.
+    """
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_IGNORED = _Ignored()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *labelvalues):
+        """
+        Return the child holding the value for the given label values (in the order of the labelnames).
+        """
+        if not self.registry.enabled:
+            return _IGNORED
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def _label_str(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for (name, value) in pairs) + "}"
+
+    def _sorted_children(self):
+        return sorted(list(self._children.items()), key=lambda item: item[0])
+
+
+class Counter(_Metric):
+    """
+    A total that only goes up, e.g. the number of stored events.
+    """
+    type = "counter"
+
+    class _Child:
+        def __init__(self):
+            self.value = 0
+            self._lock = threading.Lock()
+
+        def inc(self, amount=1):
+            with self._lock:
+                self.value += amount
+
+    def _new_child(self):
+        return self._Child()
+
+    def value(self, *labelvalues):
+        """
+        Return the current total for the given label values.
+        """
+        child = self._children.get(labelvalues)
+        return child.value if child else 0
+
+    def samples(self):
+        return ["{}{} {}".format(self.name, self._label_str(labelvalues), _format_value(child.value))
+                for (labelvalues, child) in self._sorted_children()]
+
+
+class Histogram(_Metric):
+    """
+    Counts observed values, e.g. durations in seconds, in buckets with the given upper bounds.
+    """
+    type = "histogram"
+
+    class _Child:
+        def __init__(self, buckets):
+            self.buckets = buckets
+            self.counts = [0] * (len(buckets) + 1)  # the last one counts the values above all bounds
+            self.sum = 0
+            self._lock = threading.Lock()
+
+        def observe(self, value):
+            i = bisect.bisect_left(self.buckets, value)
+            with self._lock:
+                self.counts[i] += 1
+                self.sum += value
+
+        def time(self):
+            return _Timer(self)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return self._Child(self.buckets)
+
+    def time(self, *labelvalues):
+        """
+        Return a context manager that observes the time spent in it.
+        """
+        if not self.registry.enabled:
+            return _IGNORED
+        return _Timer(self.labels(*labelvalues))
+
+    def samples(self):
+        samples = []
+        for (labelvalues, child) in self._sorted_children():
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append("{}_bucket{} {}".format(
+                    self.name, self._label_str(labelvalues, [("le", _format_value(bound))]), cumulative))
+            samples.append("{}_sum{} {}".format(self.name, self._label_str(labelvalues), _format_value(total)))
+            samples.append("{}_count{} {}".format(self.name, self._label_str(labelvalues), cumulative))
+        return samples
+
+
+class FunctionMetric:
+    """
+    A metric whose value is returned by function when rendered. The type is "gauge" or "counter".
+    """
+
+    def __init__(self, name, help, function, type="gauge", registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.type = type
+        self._function = function
+        registry.register(self)
+
+    def samples(self):
+        return ["{} {}".format(self.name, _format_value(self._function()))]
+
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+def request_metrics(prefix, registry=REGISTRY):
+    """
+    Return the counter of HTTP requests by endpoint and status and the histogram of their durations by endpoint
+    to pass to the RequestMetrics middleware.
+    """
+    return (Counter(prefix + "_http_requests_total", "Number of HTTP requests by endpoint and status.",
+                    ["endpoint", "status"], registry),
+            Histogram(prefix + "_http_request_seconds", "Duration of HTTP requests by endpoint.",
+                      ["endpoint"], registry=registry))
+
+
+class RequestMetrics:
+    """
+    ASGI middleware that counts the requests and observes their duration, including the time to stream
+    the response, in the metrics from request_metrics. Passes requests straight through while these are disabled.
+    """
+
+    def __init__(self, app, requests, seconds):
+        self.app = app
+        self._requests = requests
+        self._seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requests.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router adds the matched endpoint to the scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            self._seconds.labels(endpoint).observe(time.perf_counter() - start)
+            self._requests.labels(endpoint, str(status[0])).inc()
+
+
+def ratio(numerator, denominator):
+    """
+    Return numerator / denominator, or NaN if there is nothing to divide yet.
+    """
+    return numerator / denominator if denominator else math.nan
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""
+
+.. module:: migrate_db
+   :synopsis: One-shot conversion of the sanitised event store from one storage backend into another,
+              e.g. from a TinyDB db.json into SQLite.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import storage
+
+import argparse
+import logging
+import sys
+
+
+def migrate(source, target, batch_size=1000):
+    """
+    Copy all events from the source store into the target store,
+    reading and inserting batch_size events at a time, one transaction each, so memory does not grow with the
+    number of events. (The TinyDB backend reads its whole file for each page, though.)
+    Return the number of copied events.
+    """
+    total = len(source)
+    count = 0
+    cursor = 0
+    while True:
+        page = source.page(cursor, batch_size)
+        if not page:
+            return count
+        target.insert_many([event for (_, event) in page])
+        count += len(page)
+        cursor = page[-1][0]
+        logging.info("Copied %s/%s events", count, total)
+
+
+def __command_line_parsing(argv):
+    logger_cfg = {
+        "format":
+            "%(asctime)s %(funcName)s (%(lineno)d) [%(levelname)s]:    %(message)s"
+    }
+
+    parser = argparse.ArgumentParser(
+        description="Copy all sanitised events into a new event store.")
+    parser.add_argument("source", help="Path of the database to read from.")
+    parser.add_argument("target", help="Path of the database to write to. Should not exist yet.")
+    parser.add_argument(
+        "--from",
+        dest="source_storage",
+        help="Storage backend of the source.",
+        choices=storage.BACKENDS,
+        default="tinydb")
+    parser.add_argument(
+        "--to",
+        dest="target_storage",
+        help="Storage backend of the target.",
+        choices=storage.BACKENDS,
+        default="sqlite")
+    parser.add_argument(
+        "-l",
+        "--log",
+        help="Set the log level. Default: INFO.",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="INFO")
+
+    args = parser.parse_args(argv)
+
+    logger_cfg["level"] = getattr(logging, args.log)
+    logging.basicConfig(**logger_cfg)
+
+    return args
+
+
+def main(argv):
+    args = __command_line_parsing(argv)
+
+    source = storage.open_store(args.source_storage, args.source)
+    target = storage.open_store(args.target_storage, args.target)
+    if len(target):
+        logging.critical("Target '%s' already contains events. Refusing to migrate.", args.target)
+        sys.exit(1)
+
+    count = migrate(source, target)
+    logging.info("Migrated %s events from '%s' to '%s'", count, args.source, args.target)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+"""
+
+.. module:: output
+   :synopsis: Writes sanitised events as JSON while they are produced.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+import json
+
+OUTPUT_FORMATS = ["json", "ndjson"]
+FILE_ENDINGS = {"json": ".sanitised.json", "ndjson": ".sanitised.ndjson"}
+
+# Serialised events are collected up to this many characters before they are written to the file
+BUFFER_SIZE = 1 << 16
+
+
+class EventWriter:
+    """
+    Writes sanitised events to a text file one by one, either as a single JSON array ("json")
+    or as newline delimited JSON with one event per line ("ndjson"), so memory does not grow with the output.
+    Use as a context manager, which completes the JSON array on exit. The file itself is not closed.
+    """
+
+    def __init__(self, file, output_format="json"):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Unsupported output format: " + output_format)
+        self.count = 0
+        self._file = file
+        self._ndjson = output_format == "ndjson"
+        self._encode = json.JSONEncoder().encode
+        self._buffer = [] if self._ndjson else ["["]
+        self._buffered = 0
+
+    def write_many(self, events):
+        encode = self._encode
+        buffer = self._buffer
+        for event in events:
+            if self._ndjson:
+                text = encode(event) + "\n"
+            else:
+                text = (",\n" if self.count else "\n") + encode(event)
+            buffer.append(text)
+            self.count += 1
+            self._buffered += len(text)
+            if self._buffered >= BUFFER_SIZE:
+                self.flush()
+
+    def flush(self):
+        self._file.write("".join(self._buffer))
+        self._buffer.clear()
+        self._buffered = 0
+        self._file.flush()
+
+    def close(self):
+        if not self._ndjson:
+            self._buffer.append("\n]\n")
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an incomplete array is left open, so the output is not mistaken for a complete one
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
+        return False
@@ -0,0 +1,142 @@
+"""
+
+.. module:: reader
+   :synopsis: Reads the events of many EPCIS files through memory maps, prefetching the next files.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+import glob
+import logging
+import mmap
+import os
+import queue
+import threading
+
+from epcis_sanitiser import streaming
+
+# File endings of EPCIS documents and the streams to parse them with
+EVENT_STREAMS = {".xml": streaming.XmlEventStream, ".json": streaming.JsonEventStream,
+                 ".jsonld": streaming.JsonEventStream}
+
+# Size of the slices of a memory mapped file fed to the parser at a time
+CHUNK_SIZE = 1 << 20
+
+# Number of files read into the page cache ahead of the one being parsed
+PREFETCH_FILES = 4
+
+
+def expand_paths(paths, exclude_endings=()):
+    """
+    Return the files given by paths in order: Files as they are, glob patterns (with ** for any subdirectory)
+    replaced by the sorted files they match, and directories by the sorted EPCIS documents below them.
+    Documents ending in one of the exclude_endings, e.g. the output of earlier runs, are left out
+    unless given explicitly.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += _documents_below(path, exclude_endings)
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path, recursive=True))
+            if not matches:
+                logging.warning("No files match '%s'", path)
+            for match in matches:
+                if os.path.isdir(match):
+                    files += _documents_below(match, exclude_endings)
+                elif not match.lower().endswith(tuple(exclude_endings)):
+                    files.append(match)
+        else:
+            files.append(path)
+    return files
+
+
+def _documents_below(directory, exclude_endings):
+    documents = []
+    for (root, dirs, filenames) in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(filenames):
+            lower = filename.lower()
+            if os.path.splitext(lower)[1] in EVENT_STREAMS and not lower.endswith(tuple(exclude_endings)):
+                documents.append(os.path.join(root, filename))
+    return documents
+
+
+def iter_events(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the events of the EPCIS XML or JSON document at path (by file ending) one by one as simple python objects,
+    like events_from_file_reader.event_list_from_file returns them in its event list.
+    The file is memory mapped and parsed chunk by chunk, so it is never read into memory as a whole.
+    Raises a ValueError for unknown file endings or malformed JSON and an ElementTree.ParseError for malformed XML.
+    """
+    ending = os.path.splitext(path.lower())[1]
+    if ending not in EVENT_STREAMS:
+        raise ValueError("Filename '{}' ending not recognized.".format(path))
+    stream = EVENT_STREAMS[ending]()
+
+    with open(path, "rb") as file:
+        # empty files cannot be mapped
+        if os.fstat(file.fileno()).st_size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(0, len(mapped), chunk_size):
+                    yield from stream.feed(mapped[start:start + chunk_size])
+    yield from stream.close()
+
+
+def prefetched(paths, ahead=PREFETCH_FILES):
+    """
+    Yield the paths in order, while a thread asks the operating system to read the next files into the page cache,
+    so that reading them does not wait for the disk once their turn comes.
+    """
+    ready = queue.Queue(maxsize=ahead)
+    stop = threading.Event()
+
+    def prefetch():
+        for path in paths + [None]:
+            if path is not None:
+                _will_need(path)
+            while not stop.is_set():
+                try:
+                    ready.put(path, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    thread = threading.Thread(target=prefetch, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            path = ready.get()
+            if path is None:
+                return
+            yield path
+    finally:
+        stop.set()
+
+
+def _will_need(path):
+    try:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size and hasattr(mmap, "MADV_WILLNEED"):
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    mapped.madvise(mmap.MADV_WILLNEED)
+    except (OSError, ValueError) as ex:
+        # reading the file reports the error, if it persists
+        logging.debug("Could not prefetch '%s': %r", path, ex)
@@ -23,11 +23,57 @@ try:
 except ImportError:
     from context import epcis_sanitiser  # noqa: F401
 
+import collections
+import functools
+import itertools
 import logging
 import hashlib
 
 from epcis_event_hash_generator import hash_generator
 from epcis_sanitiser import DEFAULT_CONFIG
+from epcis_sanitiser import logs
+from epcis_sanitiser import metrics
+
+
+NI_PREFIXES = {
+    'sha256': 'ni:///sha-256;',
+    'sha3_256': 'ni:///sha3_256;',
+    'sha384': 'ni:///sha-384;',
+    'sha512': 'ni:///sha-512;'
+}
+
+
+class SaltedHasher:
+    """
+    Produces the named identifier of the hash of a value with a fixed salt appended.
+    The salt is encoded once and fed into the hash after the value,
+    so no concatenation of value and salt is ever built.
+    """
+
+    def __init__(self, hashalg='sha256', hash_salt=''):
+        if hashalg not in NI_PREFIXES:
+            raise ValueError("Unsupported Hashing Algorithm: " + hashalg)
+        self.hashalg = hashalg
+        self.hash_salt = hash_salt
+        self._prefix = NI_PREFIXES[hashalg]
+        self._new = getattr(hashlib, hashalg)
+        self._salt = hash_salt.encode('utf-8')
+
+    def hash_bytes(self, value):
+        """bytes -> str"""
+        digest = self._new(value)
+        if self._salt:
+            digest.update(self._salt)
+        return self._prefix + digest.hexdigest()
+
+    def hash(self, value):
+        """str -> str"""
+        return self.hash_bytes(value.encode('utf-8'))
+
+    def hash_many(self, values):
+        """list of str -> list of str"""
+        hash_bytes = self.hash_bytes
+        return [hash_bytes(value.encode('utf-8')) for value in values]
 
 
 def _hash_alg_to_fct(hashalg='sha256'):
@@ -35,96 +81,293 @@ def _hash_alg_to_fct(hashalg='sha256'):
     Convert the hashalg string that specifies the hashing algorithm to be used into
     the corresponding str -> str function that produces the named identifier
     """
-    if hashalg == 'sha256':
-        def hash_fct(x):
-            return 'ni:///sha-256;' + \
-                hashlib.sha256(x.encode('utf-8')).hexdigest()
-    elif hashalg == 'sha3_256':
-        def hash_fct(x):
-            return 'ni:///sha3_256;' + \
-                hashlib.sha3_256(x.encode('utf-8')).hexdigest()
-    elif hashalg == 'sha384':
-        def hash_fct(x):
-            return 'ni:///sha-384;' + \
-                hashlib.sha384(x.encode('utf-8')).hexdigest()
-    elif hashalg == 'sha512':
-        def hash_fct(x):
-            return 'ni:///sha-512;' + \
-                hashlib.sha512(x.encode('utf-8')).hexdigest()
-    else:
-        raise ValueError("Unsupported Hashing Algorithm: " + hashalg)
-
-    return hash_fct
-
-
-def sanitise_events(events, dead_drop_url, hashalg='sha256', config=DEFAULT_CONFIG):
+    return SaltedHasher(hashalg).hash
+
+
+@functools.lru_cache(maxsize=None)
+def salted_hasher(hashalg='sha256', hash_salt=''):
     """
-    Calculate the sanitized event for each event in the list and return the list of sanitized events.
+    Return the SaltedHasher for the given algorithm and salt. There are only few of them, so they are reused.
+    """
+    return SaltedHasher(hashalg, hash_salt)
+
+
+DEFAULT_HASH_CACHE_SIZE = 65536
+
+# Time per batch of events spent in each stage from the parsed document to the stored events.
+# Besides the stages of sanitise_events (hash, skip_known and sanitise), services observe e.g. parse and store.
+STAGE_SECONDS = metrics.Histogram("epcis_sanitiser_stage_seconds",
+                                  "Time spent on a batch of events per stage of the sanitisation pipeline.", ["stage"])
+
+
+HashCacheInfo = collections.namedtuple("HashCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class _HashCache:
+    """
+    A cache of the salted hashes of values by SaltedHasher, which salted_hasher hands out once per salt.
+    hash_many looks up a whole list of values at once and hashes only the misses, in one call to the
+    hasher's hash_many. With maxsize 0, values are hashed right away.
+
+    Recently used hashes are approximated by two generations of about maxsize / 2 hashes each: Hits in the old
+    generation are copied to the recent one, and once the recent one is full it replaces the old one.
+    That takes only dict operations, so no lock is needed and hits cost about as much as with functools.lru_cache.
+    Concurrent updates of the statistics may get lost.
     """
 
-    logging.debug("Sanitising {}".format(events))
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._generation_size = max(1, maxsize // 2)
+        self._recent = {}
+        self._old = {}
+
+    def hash(self, hasher, value):
+        hash = self._recent.get((hasher, value))
+        if hash is None:
+            return self.hash_many(hasher, (value,))[0]
+        self.hits += 1
+        return hash
+
+    def hash_many(self, hasher, values):
+        if not self.maxsize:
+            return hasher.hash_many(values)
+        keys = list(zip(itertools.repeat(hasher), values))
+        hashes = list(map(self._recent.get, keys))
+        if None not in hashes:
+            self.hits += len(hashes)
+            return hashes
+
+        old_get = self._old.get
+        found = {key: old_get(key) for (key, hash) in zip(keys, hashes) if hash is None}
+        missing = [key for (key, hash) in found.items() if hash is None]
+        if missing:
+            found.update(zip(missing, hasher.hash_many([value for (_, value) in missing])))
+        self._add(found)
+        self.misses += len(missing)
+        self.hits += len(hashes) - len(missing)
+        return list(map(found.get, keys, hashes))
+
+    def _add(self, hashes):
+        if len(self._recent) + len(hashes) > self._generation_size:
+            self._old = self._recent
+            self._recent = {}
+        self._recent.update(hashes)
+
+    def info(self):
+        return HashCacheInfo(self.hits, self.misses, self.maxsize, len(self._recent) + len(self._old))
+
+
+# Identifiers like EPCs, locations or parties recur in many events, so salted hashes are memoised in a
+# cache shared by all plans. See set_hash_cache_size and hash_cache_info.
+_hash_cache = _HashCache(DEFAULT_HASH_CACHE_SIZE)
+
+
+def set_hash_cache_size(maxsize):
+    """
+    Replace the hash cache by an empty one holding up to maxsize entries. 0 disables caching.
+    """
+    global _hash_cache
+    _hash_cache = _HashCache(maxsize)
+
+
+def hash_cache_info():
+    """
+    Return the hits, misses, maxsize and currsize of the hash cache.
+    """
+    return _hash_cache.info()
+
+
+class SanitisationPlan:
+    """
+    A sanitisation config compiled for a given hashing algorithm and dead drop url:
+    Every configured field is mapped to a pair of functions with the salt already bound,
+    one sanitising a single value (str -> str) and one sanitising a whole list of values at once,
+    so that sanitising an event takes a single pass over its children.
+    Plans can be pickled, e.g. to pass them to worker processes, and are compiled again when unpickled.
+    """
+
+    def __init__(self, sanitised_fields, hashalg='sha256', dead_drop_url=""):
+        salted_hasher(hashalg)  # fail early for unsupported algorithms
+
+        self.sanitised_fields = dict(sanitised_fields)
+        self.hashalg = hashalg
+        self.dead_drop_url = dead_drop_url
+        self.fields = list(sanitised_fields)  # output order
+        self.event_id_fct = None
+        self.event_type_fct = None
+        self.field_fcts = {}
 
-    hashes = hash_generator.epcis_hashes_from_events(events, hashalg)
+        for (field, hash_salt) in sanitised_fields.items():
+            # the event id is replaced by the event hash and the type is the name of the event
+            if field == "eventId":
+                # event hashes are unique, caching them would only evict useful entries
+                self.event_id_fct = _salted_hash_fcts(hashalg, hash_salt, cached=False)[0]
+            elif field == "eventType":
+                self.event_type_fct = _salted_hash_fcts(hashalg, hash_salt)[0]
+            else:
+                self.field_fcts[field] = _salted_hash_fcts(hashalg, hash_salt)
 
-    hash_fct = _hash_alg_to_fct(hashalg)
+    def __reduce__(self):
+        return (SanitisationPlan, (self.sanitised_fields, self.hashalg, self.dead_drop_url))
+
+
+def compile_plan(config=DEFAULT_CONFIG, hashalg='sha256', dead_drop_url=""):
+    """
+    Compile the config into a SanitisationPlan. The dead_drop_url defaults to the one from the config.
+    Also resizes the hash cache if the config sets a different hash_cache_size.
+    """
+    hash_cache_size = config.get("hash_cache_size", DEFAULT_HASH_CACHE_SIZE)
+    if hash_cache_size != hash_cache_info().maxsize:
+        set_hash_cache_size(hash_cache_size)
 
     if not dead_drop_url:
         dead_drop_url = config["dead_drop_url"]
+    return SanitisationPlan(config["sanitised_fields"], hashalg, dead_drop_url)
+
+
+def sanitise_events(events, dead_drop_url, hashalg='sha256', config=DEFAULT_CONFIG, plan=None, known_event_ids=None):
+    """
+    Calculate the sanitized event for each event in the list and return the list of sanitized events.
+    Pass a plan from compile_plan to sanitise many documents with the same settings,
+    the other parameters are ignored then.
+
+    known_event_ids may be a function that takes a list of sanitised eventIds and returns those of them
+    that are known already, e.g. store.known_event_ids. Events with a known eventId, or the same eventId as
+    an event before them in the list, are then skipped before any other field is sanitised.
+    This requires the eventId to be part of the sanitised fields.
+    """
+
+    logs.dump_payload(events, "Sanitising")
+
+    if plan is None:
+        plan = compile_plan(config, hashalg, dead_drop_url)
+
+    return _sanitise_event_list(events, plan, known_event_ids)
+
+
+def iter_sanitise_events(event_iterable, dead_drop_url=None, hashalg='sha256', config=DEFAULT_CONFIG, plan=None,
+                         known_event_ids=None, batch_size=1):
+    """
+    Lazily sanitise the parsed events (the items of the event list of a parsed document) from event_iterable,
+    e.g. a generator, and yield the sanitised events in the same order.
+    Only batch_size events are held at a time: They are hashed at once and their sanitised events are yielded
+    before the next batch is taken from event_iterable. A larger batch_size saves calls to the hash generator
+    and to known_event_ids.
+
+    The other parameters are those of sanitise_events. Duplicates of an eventId in different batches are only
+    skipped if known_event_ids knows the earlier one, e.g. because it is stored already.
+    """
+    if plan is None:
+        plan = compile_plan(config, hashalg, dead_drop_url)
+
+    iterator = iter(event_iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield from _sanitise_event_list(("EventList", "", batch), plan, known_event_ids)
+
+
+def _sanitise_event_list(events, plan, known_event_ids):
+    with STAGE_SECONDS.time("hash"):
+        hashes = hash_generator.epcis_hashes_from_events(events, plan.hashalg)
+    event_list = events[2]
+    if known_event_ids is not None and plan.event_id_fct:
+        with STAGE_SECONDS.time("skip_known"):
+            event_list, hashes = _skip_known_events(event_list, hashes, plan, known_event_ids)
 
     sanitised_events = []
-    for event, hash in zip(events[2], hashes):
-        sanitised_events.append(_sanitise_event(event, hash, hash_fct, dead_drop_url, config["sanitised_fields"]))
+    with STAGE_SECONDS.time("sanitise"):
+        for event, hash in zip(event_list, hashes):
+            sanitised_events.append(_sanitise_event(event, hash, plan))
 
     return sanitised_events
 
 
-def _normalise_hash_and_salt_if_necessary(value, hash_fct, hash_salt):
+def _skip_known_events(events, hashes, plan, known_event_ids):
+    event_ids = [plan.event_id_fct(hash) for hash in hashes]
+    seen = set(known_event_ids(event_ids))
+    new_events = []
+    new_hashes = []
+    for event, hash, event_id in zip(events, hashes, event_ids):
+        if event_id not in seen:
+            seen.add(event_id)
+            new_events.append(event)
+            new_hashes.append(hash)
+    logging.debug("Skipping %s known events", len(events) - len(new_events))
+    return new_events, new_hashes
+
+
+def _salted_hash_fcts(hashalg, hash_salt, cached=True):
+    """
+    Return the pair of functions that sanitise a single value and a list of values:
+    The identity if the hash_salt is None, the hash of the value with the salt appended otherwise.
+    """
     if hash_salt is None:
-        return value
-    return hash_fct(value + hash_salt)
+        return _identity, list
+
+    hasher = salted_hasher(hashalg, hash_salt)
+    if not cached:
+        return hasher.hash, hasher.hash_many
+
+    def salted_hash_fct(value):
+        return _hash_cache.hash(hasher, value)
 
+    def salted_hash_many_fct(values):
+        return _hash_cache.hash_many(hasher, values)
 
-def _sanitise_event(event, hash, hash_fct, dead_drop_url, config):
+    return salted_hash_fct, salted_hash_many_fct
 
-    logging.debug("Sanitising event: %s", event)
 
-    sanitised_event = {}
+def _identity(value):
+    return value
 
-    sanitised_event["request_event_data_at"] = dead_drop_url
 
-    for (field, hash_salt) in config.items():
-        # special handling of event id (use event hash)
-        if field == "eventId":
-            sanitised_event[field] = _normalise_hash_and_salt_if_necessary(hash, hash_fct, hash_salt)
+def _sanitise_event(event, hash, plan):
+
+    sanitised_fields = {}
+
+    if plan.event_id_fct:
+        sanitised_fields["eventId"] = plan.event_id_fct(hash)
+    if plan.event_type_fct:
+        sanitised_fields["eventType"] = plan.event_type_fct(event[0])
+
+    for key, value, children in event[2]:
+        fcts = plan.field_fcts.get(key)
+        if fcts is None:
             continue
-        # special handling of event type
-        if field == "eventType":
-            sanitised_event[field] = _normalise_hash_and_salt_if_necessary(event[0], hash_fct, hash_salt)
+        if not children:
+            sanitised_fields[key] = fcts[0](value)
             continue
 
-        # handling of all other keys
-        for key, value, children in event[2]:
-            if key == field:
-                if not children:
-                    sanitised_event[key] = _normalise_hash_and_salt_if_necessary(
-                        value, hash_fct, hash_salt)
-                else:
-                    sanitised_event[key] = []
-                    for (_, child_val, properties) in children:
-                        sanitised_value = _normalise_hash_and_salt_if_necessary(child_val, hash_fct, hash_salt)
-
-                        # check if the field has a type, if so add it as a query parameter
-                        type_query_params = [type for (name, type, []) in properties if name == 'type']
-                        if type_query_params:
-                            if len(type_query_params) > 1:
-                                logging.warn("More than one type parameter for %s.", child_val)
-                            sanitised_value += '?type=' + "&type=".join(type_query_params)
-
-                        sanitised_event[key].append(sanitised_value)
+        sanitised_values = fcts[1]([child_val for (_, child_val, _) in children])
+        for i, (_, child_val, properties) in enumerate(children):
+            if properties:
+                sanitised_values[i] = _with_type_query_params(sanitised_values[i], child_val, properties)
+        sanitised_fields[key] = sanitised_values
+
+    sanitised_event = {"request_event_data_at": plan.dead_drop_url}
+    for field in plan.fields:
+        if field in sanitised_fields:
+            sanitised_event[field] = sanitised_fields[field]
 
     return sanitised_event
 
 
+def _with_type_query_params(sanitised_value, value, properties):
+    """
+    Check if the field has a type, if so add it as a query parameter
+    """
+    type_query_params = [type for (name, type, _) in properties if name == 'type']
+    if type_query_params:
+        if len(type_query_params) > 1:
+            logging.warning("More than one type parameter for %s.", value)
+        sanitised_value += '?type=' + "&type=".join(type_query_params)
+    return sanitised_value
+
+
 def _extact_field(object, name):
     """
     Recursively search through a simple python object to find an element
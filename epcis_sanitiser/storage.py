@@ -0,0 +1,408 @@
+"""
+
+.. module:: storage
+   :synopsis: Storage backends for the sanitised events of the discovery webservice.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+import logging
+import sqlite3
+import threading
+import time
+
+from tinydb import TinyDB, Query
+
+from epcis_sanitiser import compact
+from epcis_sanitiser.bloom import BloomFilter
+from epcis_sanitiser.epc_index import EpcIndex, epcs_of_event
+
+BACKENDS = ["tinydb", "sqlite"]
+DEFAULT_PATHS = {"tinydb": "db.json", "sqlite": "db.sqlite"}
+
+# db.json files of the webservice before the service config was passed by environment hold it as a document
+_CONFIG_ID = "config"
+
+
+def open_store(backend="tinydb", path=None):
+    """
+    Open the event store of the given backend type at path (or the backends default path).
+    """
+    if not path:
+        path = DEFAULT_PATHS[backend]
+    logging.debug("Opening %s event store at '%s'", backend, path)
+    if backend == "tinydb":
+        return TinyDBEventStore(path)
+    if backend == "sqlite":
+        return SQLiteEventStore(path)
+    raise ValueError("Unsupported storage backend: " + backend)
+
+
+class EventStore:
+    """
+    Interface of a store for sanitised events.
+    """
+
+    def insert_many(self, events, skip_known=False):
+        """
+        Store all events at once and return their ids. With skip_known, events whose eventId is stored already
+        or occurs earlier in events are not stored and get the id None instead. Checking and storing is atomic,
+        so concurrent inserts never store an eventId twice.
+        """
+        raise NotImplementedError
+
+    def find_by_event_id(self, event_id):
+        """Return all stored events with the given eventId."""
+        raise NotImplementedError
+
+    def find_by_epc(self, epc):
+        """Return all stored events containing the (hashed) epc in one of the epc_index.EPC_FIELDS."""
+        raise NotImplementedError
+
+    def known_event_ids(self, event_ids):
+        """Return the set of the given eventIds of which an event is stored."""
+        raise NotImplementedError
+
+    def all(self):
+        """Return all stored events."""
+        raise NotImplementedError
+
+    def page(self, cursor=0, limit=1000):
+        """Return up to limit pairs (id, event) of the events stored after the one with id cursor, ordered by id."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class TinyDBEventStore(EventStore):
+    """
+    Keeps all events in a TinyDB JSON file. Each write rewrites the whole file, so this is meant for demos only.
+    EPC lookups are served from an in-memory EpcIndex built on startup, eventId checks from a set of all eventIds.
+    TinyDB is not thread safe, so every access to the database or the in-memory indices takes the same lock.
+    """
+
+    def __init__(self, path):
+        self._db = TinyDB(path)
+        self._lock = threading.Lock()
+        self._epc_index = EpcIndex.from_documents(self._events())
+        self._event_ids = {event.get("eventId") for event in self._events()}
+
+    def _events(self):
+        return [doc for doc in self._db.all() if doc.get("id") != _CONFIG_ID]
+
+    def insert_many(self, events, skip_known=False):
+        with self._lock:  # a single write of the file for all events
+            seen_event_ids = set()
+            new = [not skip_known or _is_new(event, self._event_ids, seen_event_ids) for event in events]
+            new_doc_ids = iter(self._db.insert_multiple([event for (event, is_new) in zip(events, new) if is_new]))
+            doc_ids = [next(new_doc_ids) if is_new else None for is_new in new]
+            for doc_id, event in zip(doc_ids, events):
+                if doc_id is not None:
+                    self._epc_index.add(doc_id, event)
+                    self._event_ids.add(event.get("eventId"))
+        return doc_ids
+
+    def find_by_event_id(self, event_id):
+        with self._lock:
+            return self._db.search(Query().eventId == event_id)
+
+    def find_by_epc(self, epc):
+        with self._lock:
+            return self._db.get(doc_ids=self._epc_index.lookup(epc))
+
+    def known_event_ids(self, event_ids):
+        with self._lock:
+            return self._event_ids.intersection(event_ids)
+
+    def all(self):
+        with self._lock:
+            return self._events()
+
+    def page(self, cursor=0, limit=1000):
+        with self._lock:
+            events = sorted((doc.doc_id, doc) for doc in self._events() if doc.doc_id > cursor)
+        return events[:limit]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events())
+
+
+class SQLiteEventStore(EventStore):
+    """
+    Keeps all events in an SQLite database in WAL mode, so readers are not blocked by a running insert.
+    Writers of several threads or processes take turns on the database lock, waiting up to BUSY_TIMEOUT seconds.
+    Events are stored in the compact encoding next to an indexed eventId column,
+    and every epc is recorded in a separate indexed table. Index keys are compact.encode_key of the values.
+    The first event stored for each eventId is also part of a unique index, so that skipping known events
+    is a single INSERT OR IGNORE, which is atomic even between processes.
+    An in-memory Bloom filter of all eventIds spares the index lookups for new eventIds. Before each check,
+    it catches up with the events inserted since, which covers inserts by other processes as well.
+    """
+
+    _SCHEMA = [
+        # first_of_event_id marks the first stored event of each eventId, later events with the same eventId,
+        # stored while known events are not skipped, stay out of the unique index
+        "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, event_id BLOB, event BLOB NOT NULL, "
+        "first_of_event_id INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS events_event_id ON events (event_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS events_first_event_id ON events (event_id) WHERE first_of_event_id = 1",
+        "CREATE TABLE IF NOT EXISTS event_epcs (epc BLOB NOT NULL, event INTEGER NOT NULL, "
+        "PRIMARY KEY (epc, event)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS strings (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)"
+    ]
+    _FORMAT_VERSION = 1
+
+    BUSY_TIMEOUT = 30
+    EVENT_ID_FILTER_CAPACITY = 1000000
+    _MAX_PARAMETERS = 500  # stay well below SQLITE_MAX_VARIABLE_NUMBER
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._strings = _StringTable(self._connection)
+        self._write_lock = threading.Lock()
+        self._event_id_filter = None
+        self._event_id_filter_lock = threading.Lock()
+        self._event_id_filter_max_id = 0
+
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")  # one process at a time creates the schema
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                for statement in self._SCHEMA:
+                    connection.execute(statement)
+                connection.execute("PRAGMA user_version = {}".format(self._FORMAT_VERSION))
+            elif version != self._FORMAT_VERSION:
+                raise ValueError("Unsupported format version {} of the database '{}'".format(version, path))
+
+    def _connection(self):
+        """
+        sqlite3 connections must not be shared between threads, so every thread gets its own one.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=self.BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _event_id_key(self, event):
+        event_id = event.get("eventId")
+        if event_id is None:
+            return None
+        return compact.encode_key(event_id, self._strings)
+
+    def _insert_epcs(self, connection, id, event):
+        connection.executemany("INSERT OR IGNORE INTO event_epcs (epc, event) VALUES (?, ?)",
+                               [(compact.encode_key(epc, self._strings), id) for epc in epcs_of_event(event)])
+
+    def insert_many(self, events, skip_known=False):
+        # no other thread may pick up the ids of strings added in a transaction that is rolled back
+        with self._write_lock:
+            try:
+                with self._connection() as connection:  # one transaction for all events
+                    return [self._insert_event(connection, event, skip_known) for event in events]
+            except Exception:
+                self._strings.clear()
+                raise
+
+    def _insert_event(self, connection, event, skip_known):
+        """
+        Insert the event and return its id, or None if it is skipped as known.
+        """
+        row = (self._event_id_key(event), compact.encode_event(event, self._strings))
+        # fails for eventIds that are stored already, see _SCHEMA
+        cursor = connection.execute("INSERT OR IGNORE INTO events (event_id, event, first_of_event_id) "
+                                    "VALUES (?, ?, 1)", row)
+        if not cursor.rowcount:
+            if skip_known:
+                return None
+            cursor = connection.execute("INSERT INTO events (event_id, event) VALUES (?, ?)", row)
+        self._insert_epcs(connection, cursor.lastrowid, event)
+        return cursor.lastrowid
+
+    def _select_events(self, query, parameters=()):
+        rows = self._connection().execute(query, parameters)
+        return [compact.decode_event(event, self._strings) for (event,) in rows]
+
+    def find_by_event_id(self, event_id):
+        key = compact.encode_key(event_id, self._strings, add=False)
+        if key is None:
+            return []
+        return self._select_events("SELECT event FROM events WHERE event_id = ? ORDER BY id", (key,))
+
+    def find_by_epc(self, epc):
+        key = compact.encode_key(epc, self._strings, add=False)
+        if key is None:
+            return []
+        return self._select_events("SELECT events.event FROM event_epcs JOIN events ON events.id = event_epcs.event "
+                                   "WHERE event_epcs.epc = ? ORDER BY events.id", (key,))
+
+    def known_event_ids(self, event_ids):
+        keys = {}
+        for event_id in set(event_ids):
+            key = compact.encode_key(event_id, self._strings, add=False)
+            if key is not None:
+                keys[key] = event_id
+
+        with self._event_id_filter_lock:
+            self._update_event_id_filter()
+            candidates = [key for key in keys if key in self._event_id_filter]
+
+        known = set()
+        for i in range(0, len(candidates), self._MAX_PARAMETERS):
+            chunk = candidates[i:i + self._MAX_PARAMETERS]
+            rows = self._connection().execute("SELECT DISTINCT event_id FROM events WHERE event_id IN ({})".format(
+                ",".join("?" * len(chunk))), chunk)
+            known.update(keys[key] for (key,) in rows)
+        return known
+
+    def _update_event_id_filter(self):
+        """
+        Add the eventId keys of all events inserted since the last update to the filter.
+        The filter is rebuilt with twice the capacity once it is full.
+        """
+        if self._event_id_filter is None or self._event_id_filter.count > self._event_id_filter.capacity:
+            capacity = max(self.EVENT_ID_FILTER_CAPACITY, 2 * len(self))
+            logging.debug("Building eventId filter for %s events", capacity)
+            self._event_id_filter = BloomFilter(capacity)
+            self._event_id_filter_max_id = 0
+
+        rows = self._connection().execute("SELECT id, event_id FROM events WHERE id > ? ORDER BY id",
+                                          (self._event_id_filter_max_id,))
+        for (id, key) in rows:
+            if key is not None:
+                self._event_id_filter.add(key)
+            self._event_id_filter_max_id = id
+
+    def all(self):
+        return self._select_events("SELECT event FROM events ORDER BY id")
+
+    def page(self, cursor=0, limit=1000):
+        rows = self._connection().execute("SELECT id, event FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                                          (cursor, limit))
+        return [(id, compact.decode_event(event, self._strings)) for (id, event) in rows]
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+
+def _is_new(event, known_event_ids, seen_event_ids):
+    """
+    Return whether the eventId of the event is neither known nor seen before and add it to the seen_event_ids.
+    Events without eventId are always new.
+    """
+    event_id = event.get("eventId")
+    if event_id is None:
+        return True
+    if event_id in known_event_ids or event_id in seen_event_ids:
+        return False
+    seen_event_ids.add(event_id)
+    return True
+
+
+class _StringTable:
+    """
+    The dictionary of the compact encoding of an SQLite store: the strings table, cached in memory.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._ids = {}
+        self._strings = {}
+
+    def id_of(self, string, add=True):
+        id = self._ids.get(string)
+        if id is None:
+            connection = self._connection()
+            if add:
+                connection.execute("INSERT OR IGNORE INTO strings (value) VALUES (?)", (string,))
+            row = connection.execute("SELECT id FROM strings WHERE value = ?", (string,)).fetchone()
+            if row is None:
+                return None
+            id = row[0]
+            self._ids[string] = id
+            self._strings[id] = string
+        return id
+
+    def string_of(self, id):
+        string = self._strings.get(id)
+        if string is None:
+            (string,) = self._connection().execute("SELECT value FROM strings WHERE id = ?", (id,)).fetchone()
+            self._ids[string] = id
+            self._strings[id] = string
+        return string
+
+    def clear(self):
+        self._ids = {}
+        self._strings = {}
+
+
+class GroupCommitWriter:
+    """
+    Coalesces the insert_many calls of concurrent threads into a single insert_many on the store.
+    The first caller opens a batch and waits window seconds for others to join, then writes the whole batch
+    in one go. All callers return once the batch is written, each getting the ids of its own events.
+    Calls with and without skip_known are batched separately. Known events are skipped by the store when the batch
+    is written, which also skips the repeated eventIds of concurrent callers.
+    """
+
+    class _Batch:
+        def __init__(self):
+            self.events = []
+            self.ids = None
+            self.error = None
+            self.done = threading.Event()
+
+    def __init__(self, store, window):
+        self._store = store
+        self._window = window
+        self._lock = threading.Lock()
+        self._pending = {}  # by skip_known
+
+    def insert_many(self, events, skip_known=False):
+        with self._lock:
+            batch = self._pending.get(skip_known)
+            leader = batch is None
+            if leader:
+                batch = self._pending[skip_known] = self._Batch()
+            start = len(batch.events)
+            batch.events.extend(events)
+
+        if leader:
+            time.sleep(self._window)
+            with self._lock:
+                del self._pending[skip_known]
+            logging.debug("Group commit of %s events", len(batch.events))
+            try:
+                batch.ids = self._store.insert_many(batch.events, skip_known)
+            except Exception as ex:
+                batch.error = ex
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error:
+            raise batch.error
+        return batch.ids[start:start + len(events)]
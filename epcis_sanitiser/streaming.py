@@ -0,0 +1,415 @@
+"""
+
+.. module:: streaming
+   :synopsis: Incremental parsing of EPCIS documents that are read in chunks, e.g. from a request stream.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+import codecs
+import json
+import re
+import xml.etree.ElementTree as ElementTree
+
+from epcis_event_hash_generator import json_to_py
+from epcis_event_hash_generator import json_xml_model_mismatch_correction
+
+# EPCIS extension elements are transparent, their children are treated as children of the parent
+_EXTENSION_TAGS = ("extension", "baseExtension")
+
+# Maximal number of characters a single JSON value, e.g. an event, may take in a document
+MAX_VALUE_SIZE = 16 * 1024 * 1024
+
+
+class XmlEventStream:
+    """
+    Parse an EPCIS XML document chunk by chunk. Each call to feed returns the events that were completed
+    by the given chunk, as simple python objects like xml_to_py.event_list_from_epcis_document_str produces them.
+    Completed events are dropped from the parse tree, so memory is bounded by the size of a single event.
+    """
+
+    def __init__(self):
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._open_elements = []
+        self._has_event_list = False
+
+    def feed(self, chunk):
+        """
+        Feed the next chunk (bytes or str) of the document and return the list of events completed by it.
+        Raises an ElementTree.ParseError for malformed XML.
+        """
+        self._parser.feed(chunk)
+        return self._read_events()
+
+    def close(self):
+        """
+        Signal the end of the document and return the events completed by that, if any.
+        Raises a ValueError if the document has no EventList.
+        """
+        self._parser.close()
+        events = self._read_events()
+        if not self._has_event_list:
+            raise ValueError("No EventList in EPCIS XML document")
+        return events
+
+    def _read_events(self):
+        events = []
+        for (kind, element) in self._parser.read_events():
+            if kind == "start":
+                self._open_elements.append(element)
+                if element.tag == "EventList" and len(self._path()) == 3:
+                    self._has_event_list = True
+                continue
+
+            self._open_elements.pop()
+            if element.tag in _EXTENSION_TAGS:
+                continue
+            # <root><EPCISBody><EventList><event>, cf. root.find("*EventList") in xml_to_py
+            path = self._path()
+            if len(path) == 3 and path[2].tag == "EventList":
+                events.append(_element_to_py(element))
+                self._open_elements[-1].remove(element)
+
+        return events
+
+    def _path(self):
+        return [open_element for open_element in self._open_elements if open_element.tag not in _EXTENSION_TAGS]
+
+
+def _children(element):
+    for child in element:
+        if child.tag in _EXTENSION_TAGS:
+            yield from _children(child)
+        else:
+            yield child
+
+
+def _element_to_py(element):
+    """
+    Convert the element into a simple python object the same way xml_to_py does,
+    i.e. attributes become children and all children are sorted.
+    """
+    children = [(key, value, []) for (key, value) in element.items()]
+    children += [_element_to_py(child) for child in _children(element)]
+    children.sort()
+
+    text = ""
+    if element.text:
+        text = element.text.strip()
+
+    return (element.tag, text, children)
+
+
+class JsonEventStream:
+    """
+    Parse an EPCIS JSON(-LD) document chunk by chunk. Each call to feed returns the events that were completed
+    by the given chunk, as simple python objects like json_to_py.event_list_from_epcis_document_json produces them.
+
+    Only a single event of epcisBody.eventList is held in memory at a time. All other top level values
+    are small and parsed as a whole. No value may take more than max_value_size characters, though.
+    Namespaces from the @context are needed to convert the events, so if the epcisBody comes before the @context,
+    its events are held back until the @context (or the end of the document) is reached.
+    In practice, the @context comes first.
+    """
+
+    def __init__(self, max_value_size=MAX_VALUE_SIZE):
+        self._max_value_size = max_value_size
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._closed = False
+        self._done = False
+        self._events = []
+        self._context_seen = False
+        self._held_back_events = []
+        self._has_events = False
+        self._parser = self._parse_document()
+
+    def feed(self, chunk):
+        """
+        Feed the next chunk (bytes or str) of the document and return the list of events completed by it.
+        Raises a ValueError for malformed documents, which may be detected only on close.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return self._run()
+
+    def close(self):
+        """
+        Signal the end of the document and return the events completed by that, if any.
+        """
+        self._closed = True
+        self._buffer = self._buffer[self._pos:] + self._text_decoder.decode(b"", final=True)
+        self._pos = 0
+        events = self._run()
+        if not self._done:
+            raise ValueError("Incomplete EPCIS JSON document")
+        return events
+
+    def _run(self):
+        if not self._done:
+            try:
+                next(self._parser)
+            except StopIteration:
+                self._done = True
+        events = self._events
+        self._events = []
+        return events
+
+    # The parsing functions below are generators that yield whenever they need more input than the buffer holds.
+
+    def _parse_document(self):
+        yield from self._expect("{")
+        first = True
+        while True:
+            key = yield from self._next_key(first)
+            if key is _END:
+                break
+            first = False
+            if key == "epcisBody":
+                yield from self._parse_body()
+                continue
+            value = yield from self._value()
+            if key == "@context":
+                _collect_namespaces(value)
+                self._add_held_back_events()
+
+        if not self._has_events:
+            raise ValueError("No epcisBody with an eventList or event in EPCIS JSON document")
+        self._add_held_back_events()
+        yield from self._expect_end()
+
+    def _parse_body(self):
+        yield from self._expect("{")
+        first = True
+        while True:
+            key = yield from self._next_key(first)
+            if key is _END:
+                return
+            first = False
+            if key == "eventList":
+                self._has_events = True
+                yield from self._parse_event_list()
+            elif key == "event":
+                self._has_events = True
+                self._add_event((yield from self._value()))
+            else:
+                yield from self._value()
+
+    def _parse_event_list(self):
+        yield from self._expect("[")
+        first = True
+        while True:
+            char = yield from self._next_char()
+            if char == "]":
+                self._pos += 1
+                return
+            if not first:
+                yield from self._expect(",")
+            first = False
+            self._add_event((yield from self._value()))
+
+    def _add_event(self, event):
+        if not isinstance(event, dict):
+            raise ValueError("Expecting an object as event in EPCIS JSON document, got {}".format(event))
+        if not self._context_seen:
+            self._held_back_events.append(event)
+            return
+        try:
+            self._events.append(json_xml_model_mismatch_correction.deep_structure_correction(
+                json_to_py._json_to_py(event)))
+        except KeyError as ex:
+            raise ValueError("Unknown namespace prefix in EPCIS JSON document: {}".format(ex))
+
+    def _add_held_back_events(self):
+        """
+        Convert the events before the @context, once it is known or there is none.
+        """
+        self._context_seen = True
+        events = self._held_back_events
+        self._held_back_events = []
+        for event in events:
+            self._add_event(event)
+
+    def _next_key(self, first):
+        """
+        Parse the next '"key":' of the current object and return the key, or _END if the object is closed.
+        """
+        char = yield from self._next_char()
+        if char == "}":
+            self._pos += 1
+            return _END
+        if not first:
+            yield from self._expect(",")
+        key = yield from self._value()
+        if not isinstance(key, str):
+            raise ValueError("Expecting an object key in EPCIS JSON document, got {}".format(key))
+        yield from self._expect(":")
+        return key
+
+    def _next_char(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+        """
+        while True:
+            self._skip_whitespace()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._closed:
+                raise ValueError("Incomplete EPCIS JSON document")
+            yield
+
+    def _expect_end(self):
+        """
+        Make sure that nothing but whitespace follows the document.
+        """
+        while True:
+            self._skip_whitespace()
+            if self._pos < len(self._buffer):
+                raise ValueError("Unexpected '{}' after EPCIS JSON document".format(
+                    self._buffer[self._pos:self._pos + 20]))
+            if self._closed:
+                return
+            yield
+
+    def _skip_whitespace(self):
+        while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+            self._pos += 1
+
+    def _expect(self, expected):
+        char = yield from self._next_char()
+        if char != expected:
+            raise ValueError("Expecting '{}' in EPCIS JSON document, got '{}'".format(expected, char))
+        self._pos += 1
+
+    def _value(self):
+        """
+        Parse and return the complete JSON value at the current position.
+        The end of the value is searched in each chunk only once and the value is decoded once it is complete.
+        """
+        char = yield from self._next_char()
+        value_end = _ValueEnd(char)
+        parts = []
+        size = 0
+        while True:
+            end = value_end.find(self._buffer, self._pos)
+            if end is None and self._closed:
+                if not value_end.is_scalar:
+                    raise ValueError("Incomplete EPCIS JSON document")
+                end = len(self._buffer)
+            if end is not None:
+                parts.append(self._buffer[self._pos:end])
+                self._pos = end
+                return self._decode("".join(parts))
+
+            size += len(self._buffer) - self._pos
+            if size > self._max_value_size:
+                raise ValueError("JSON value of more than {} characters in EPCIS JSON document".format(
+                    self._max_value_size))
+            parts.append(self._buffer[self._pos:])
+            self._pos = len(self._buffer)
+            yield
+
+    def _decode(self, text):
+        value, end = self._decoder.raw_decode(text)
+        if end != len(text):
+            raise ValueError("Unexpected '{}' in EPCIS JSON document".format(text[end:end + 20]))
+        return value
+
+
+def _collect_namespaces(context):
+    """
+    Collect the namespace prefixes of the JSON-LD @context for json_to_py. The @context is a URL, an object or a list
+    of both. Other definitions than the IRI of a prefix, like the objects of expanded term definitions, are ignored.
+    """
+    for item in context if isinstance(context, list) else [context]:
+        if isinstance(item, str):
+            continue
+        if not isinstance(item, dict):
+            raise ValueError("Expecting a URL or an object as @context of EPCIS JSON document, got {}".format(item))
+        json_to_py._collect_namespaces_from_jsonld_context([{key: val for (key, val) in item.items()
+                                                             if isinstance(val, str)}])
+
+
+class _ValueEnd:
+    """
+    Find the end of a JSON value that starts with first_char in the text of consecutive chunks, keeping track
+    of the nesting and of strings in between. The value itself is not validated.
+    """
+
+    def __init__(self, first_char):
+        self.is_scalar = first_char not in '"[{'
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def find(self, text, pos):
+        """
+        Return the end of the value in text, scanning from pos, or None if the value continues after text.
+        """
+        if self.is_scalar:
+            match = _SCALAR_END.search(text, pos)
+            return match.start() if match else None
+
+        while True:
+            if self._in_string:
+                pos = self._string_end(text, pos)
+                if pos is None:
+                    return None
+                if not self._depth:
+                    return pos
+            match = _STRUCTURE.search(text, pos)
+            if not match:
+                return None
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if not self._depth:
+                    return pos
+
+    def _string_end(self, text, pos):
+        while True:
+            if self._escaped:
+                if pos == len(text):
+                    return None
+                pos += 1
+                self._escaped = False
+            match = _STRING_END.search(text, pos)
+            if not match:
+                return None
+            pos = match.end()
+            if match.group() == '"':
+                self._in_string = False
+                return pos
+            self._escaped = True
+
+
+_END = object()
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_END = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,:\]}]')
@@ -24,27 +24,90 @@ try:
 except ImportError:
     from context import epcis_sanitiser  # noqa: F401
 
+from epcis_sanitiser import logs
+from epcis_sanitiser import metrics
 from epcis_sanitiser import sanitiser
+from epcis_sanitiser import storage
+from epcis_sanitiser import streaming
+from epcis_sanitiser import workers
 
-
-from epcis_event_hash_generator import json_to_py
-from epcis_event_hash_generator import xml_to_py
-
-from fastapi import FastAPI, HTTPException, Body, Request
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.openapi.utils import get_openapi
+from starlette.concurrency import run_in_threadpool
 
 import uvicorn
 import argparse
+import contextlib
+import itertools
 import sys
 import logging
 import json
-
-from tinydb import TinyDB, Query
-
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+from collections import namedtuple
+from types import MappingProxyType
+from typing import Optional
+
+# The storage and the service config are passed by main via the environment, since uvicorn imports the app
+# in a fresh module of every worker process.
+SERVICE_CONFIG_ENV = "EPCIS_SANITISER_SERVICE_CONFIG"
+STORAGE_ENV = "EPCIS_SANITISER_STORAGE"
+DB_PATH_ENV = "EPCIS_SANITISER_DB"
+GROUP_COMMIT_WINDOW_ENV = "EPCIS_SANITISER_GROUP_COMMIT_WINDOW"
+PROCESSES_ENV = "EPCIS_SANITISER_PROCESSES"
+MAX_PENDING_ENV = "EPCIS_SANITISER_MAX_PENDING"
+DEFAULT_MAX_PENDING = 64
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_PAGE_SIZE = 1000
+
+# The service config as stored by main: the parsed command line args and the sanitisation config,
+# plus the sanitisation plan compiled from both.
+ServiceConfig = namedtuple("ServiceConfig", ["args", "config", "plan"])
 
 app = FastAPI()
-db = TinyDB('db.json')
+_store = None
+_writer = None
+_store_lock = threading.Lock()
+_service_config = None
+_service_config_lock = threading.RLock()
+_pool = None
+_pool_lock = threading.Lock()
+_admission_queue = None
+
+# Recorded only if the service runs with --metrics, see the metrics module. Parsing and hashing in worker processes
+# are not observed in the stage histogram and do not use the hash cache of the webservice process.
+EVENTS = metrics.Counter("epcis_sanitiser_events_total",
+                         "Number of posted events by outcome: stored, or skipped as stored already.", ["outcome"])
+DOCUMENTS = metrics.Counter("epcis_sanitiser_documents_total",
+                            "Number of posted EPCIS documents by format and outcome: stored or rejected.",
+                            ["format", "outcome"])
+HTTP_REQUESTS, HTTP_REQUEST_SECONDS = metrics.request_metrics("epcis_sanitiser")
+metrics.FunctionMetric("epcis_sanitiser_stored_events", "Number of events in the store.", lambda: len(__store()))
+metrics.FunctionMetric("epcis_sanitiser_pending_requests", "Number of POST requests being processed.",
+                       lambda: _admission_queue.pending if _admission_queue else 0)
+metrics.FunctionMetric("epcis_sanitiser_hash_cache_hits_total", "Number of salted hashes found in the hash cache.",
+                       lambda: sanitiser.hash_cache_info().hits, "counter")
+metrics.FunctionMetric("epcis_sanitiser_hash_cache_misses_total", "Number of salted hashes not in the hash cache.",
+                       lambda: sanitiser.hash_cache_info().misses, "counter")
+metrics.FunctionMetric("epcis_sanitiser_hash_cache_hit_ratio", "Share of salted hashes found in the hash cache.",
+                       lambda: __hash_cache_hit_ratio())
+app.add_middleware(metrics.RequestMetrics, requests=HTTP_REQUESTS, seconds=HTTP_REQUEST_SECONDS)
+
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown()
+
+
+@app.on_event("startup")
+def load_service_config():
+    __service_config()
 
 
 @app.get("/", include_in_schema=False)
@@ -53,12 +116,22 @@ def redirect_to_docs():
 
 
 @app.get("/db_dump")
-def get_all_sanitised_event():
+def get_all_sanitised_event(cursor: int = 0, limit: Optional[int] = Query(None, ge=1), ndjson: bool = False):
     """
-    Get a complete DB dump including ALL events.
-    This should only be used for debugging purposes, since no pagination is implemented.
+    Get a DB dump of the events stored after the cursor (default: ALL events).
+    With a limit, at most limit events are returned and the cursor of the next page is sent
+    in the X-Next-Cursor header, which is missing on the last page.
+    With ndjson, the events are streamed as newline delimited JSON instead, reading the store page by page.
     """
-    return db.all()
+    if ndjson:
+        return StreamingResponse(__ndjson_events(cursor), media_type="application/x-ndjson")
+    if limit is None and not cursor:
+        return __store().all()
+    page = __store().page(cursor, limit or len(__store()))
+    headers = {}
+    if limit and len(page) == limit:
+        headers[NEXT_CURSOR_HEADER] = str(page[-1][0])
+    return JSONResponse([event for (_, event) in page], headers=headers)
 
 
 @app.get("/event/{eventHash}")
@@ -70,8 +143,7 @@ def get_sanitised_event(eventHash: str):
     eventId = r"ni:///" + eventHash
     logging.debug("looking for event %s", eventId)
 
-    Event = Query()
-    events = db.search(Event.eventId == eventId)
+    events = __store().find_by_event_id(eventId)
     if events:
         return events
 
@@ -84,24 +156,14 @@ def get_sanitised_event_by_epc(epcHash: str):
     """
     Takes the epc NI without the ni:/// prefix and returns all matching
     sanitised events, if any.
-    This lookup scans in epc, input, output, child and parent list,
-    as well as in the child, input and output quantity lists.
+    This lookup covers the epc, input, output, child and parent list,
+    as well as the child, input and output quantity lists.
+    Each matching event is returned once, in the order it was stored.
     """
-    __set_logging_cfg_from_db()
     epc = r"ni:///" + epcHash
     logging.debug("looking for event with epc %s", epc)
 
-    Event = Query()
-    events = db.search(Event.epcList.test(lambda val: epc in val))
-    events += db.search(Event.inputEPCList.test(lambda val: epc in val))
-    events += db.search(Event.outputEPCList.test(lambda val: epc in val))
-    events += db.search(Event.childEPCs.test(lambda val: epc in val))
-    events += db.search(Event.parentID == epc)
-
-    events += db.search(Event.quantityList.test(lambda val: epc in val))
-    events += db.search(Event.childQuantityList.test(lambda val: epc in val))
-    events += db.search(Event.inputQuantityList.test(lambda val: epc in val))
-    events += db.search(Event.outputQuantityList.test(lambda val: epc in val))
+    events = __store().find_by_epc(epc)
 
     if events:
         return events
@@ -111,63 +173,371 @@ def get_sanitised_event_by_epc(epcHash: str):
 
 
 @app.post("/sanitise_json_event/")
-def sanitise_and_store_json_event(json_events: dict = Body(...)):
+async def sanitise_and_store_json_event(request: Request, return_events: bool = True):
     """
     Post an epcis event in JSON format to store a sanitised version.
-    """
-    __set_logging_cfg_from_db()
-    logging.debug("Sanitising JSON events %s", json_events)
-    events = json_to_py.event_list_from_epcis_document_json(json_events)
+    Also returns the stored data.
 
-    return __sanitise_and_store_events(events)
+    The document is parsed and its events are sanitised while it is received, or as a whole by a worker process
+    if the service runs with --processes. The events are stored at once when the document is complete,
+    so nothing is stored of a malformed document. Set return_events to false to only get the number of stored
+    events back.
+    """
+    with __admitted():
+        return await __sanitise_and_store_stream(request, streaming.JsonEventStream, "JSON", return_events)
 
 
 @app.post("/sanitise_xml_event/")
-async def sanitise_and_store_xml_event(request: Request):
+async def sanitise_and_store_xml_event(request: Request, return_events: bool = True):
     """
     Post an epcis event in XML format to store a sanitised + hashed version in the discovery service.
     Also returns the stored data.
+
+    The document is parsed and its events are sanitised while it is received, or as a whole by a worker process
+    if the service runs with --processes. The events are stored at once when the document is complete,
+    so nothing is stored of a malformed document. Set return_events to false to only get the number of stored
+    events back.
+    """
+    with __admitted():
+        return await __sanitise_and_store_stream(request, streaming.XmlEventStream, "XML", return_events)
+
+
+@app.post("/sanitise_documents/")
+async def sanitise_and_store_documents(request: Request, return_events: bool = True):
+    """
+    Post many epcis documents at once as newline delimited JSON to store a sanitised version of all their events
+    with a single write. Each line holds either a JSON EPCIS document or a JSON string containing an XML one.
+
+    Returns the total number of stored events and a result per document, in the order they were posted:
+    The number of stored events and, unless return_events is false, the sanitised events of the document,
+    or the error if the document is rejected. Rejected documents do not keep the others from being stored.
+    """
+    with __admitted():
+        start = time.perf_counter()
+        body = await request.body()
+        documents = [line for line in body.splitlines() if line.strip()]
+        if not documents:
+            raise HTTPException(
+                status_code=400, detail="Expecting NDJSON Body")
+        pool = __pool()
+        if pool is None:
+            # parsing, hashing and storing may wait for the group commit, which must not block the event loop
+            response = await run_in_threadpool(__sanitise_and_store_documents, documents, return_events)
+        else:
+            with sanitiser.STAGE_SECONDS.time("pool"):
+                results = await pool.sanitise_documents(documents)
+            response = await run_in_threadpool(__store_documents, results, return_events)
+        logs.summary("Stored batch", documents=len(documents), stored_events=response["stored_events"],
+                     bytes=len(body), seconds=time.perf_counter() - start)
+        return response
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Get the metrics of the webservice process answering in the Prometheus text format:
+    Durations per pipeline stage and request, the number of posted events and documents,
+    the size of the store and the hit ratio of the hash cache. Requires the webservice to run with --metrics.
+    """
+    __service_config()
+    if not metrics.REGISTRY.enabled:
+        raise HTTPException(
+            status_code=404, detail="Metrics are disabled, run the webservice with --metrics")
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post("/reload_config")
+def reload_config():
+    """
+    Re-read the sanitisation config file the service was started with (if any)
+    and apply it to all subsequent requests. Returns the config now in use.
+    The config is replaced in the worker process answering this request only, so with several workers,
+    restart the service instead. Requests being processed meanwhile finish with the config they started with.
+    """
+    global _service_config
+    with _service_config_lock:
+        args = __service_config().args
+        config = __load_sanitisation_config(args.get("sanitisation_config_file"))
+        _service_config = __make_service_config(args, config)
+        return _service_config.config
+
+
+def __store():
+    global _store, _writer
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = storage.open_store(os.environ.get(STORAGE_ENV, "tinydb"), os.environ.get(DB_PATH_ENV))
+                window_in_ms = float(os.environ.get(GROUP_COMMIT_WINDOW_ENV, 0))
+                _writer = storage.GroupCommitWriter(store, window_in_ms / 1000) if window_in_ms > 0 else store
+                _store = store
+    return _store
+
+
+def __writer():
+    """
+    Return the object to insert events with. Either the store itself or a group commit writer in front of it.
+    """
+    __store()
+    return _writer
+
+
+def __ndjson_events(cursor):
+    """
+    Yield the events stored after the cursor as lines of JSON, holding only a single page in memory.
     """
-    __set_logging_cfg_from_db()
+    while True:
+        page = __store().page(cursor, NDJSON_PAGE_SIZE)
+        for (cursor, event) in page:
+            yield json.dumps(event) + "\n"
+        if len(page) < NDJSON_PAGE_SIZE:
+            return
+
+
+def __service_config():
+    """
+    Return the service config, which is read from the environment only once.
+    """
+    global _service_config
+    if _service_config is None:
+        with _service_config_lock:
+            if _service_config is None:
+                _service_config = __read_service_config()
+    return _service_config
+
+
+def __read_service_config():
+    stored_config = json.loads(os.environ[SERVICE_CONFIG_ENV])
+    return __make_service_config(stored_config["args"], stored_config["config"])
+
+
+def __make_service_config(args, config):
+    args = __freeze(args)
+    config = __freeze(config)
+    plan = sanitiser.compile_plan(config, args["algorithm"], args["dead_drop_url"])
+    service_config = ServiceConfig(args=args, config=config, plan=plan)
+    metrics.REGISTRY.enabled = args.get("metrics", False)
+
+    log_lvl = service_config.args["log"]
+    logs.basic_config(args.get("log_format", "text"), **__logger_cfg(log_lvl))
+    logging.getLogger().setLevel(__logger_cfg(log_lvl)["level"])
+    logs.set_payload_sample_rate(args.get("payload_sample_rate", logs.DEFAULT_PAYLOAD_SAMPLE_RATE))
+    logging.debug("Setting log level: %s", log_lvl)
+    logging.debug("Service config: args %s, config %s", args, config)
+
+    return service_config
+
+
+def __freeze(obj):
+    """
+    Recursively turn dicts into read only mappings and lists into tuples.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({key: __freeze(val) for key, val in obj.items()})
+    if isinstance(obj, list):
+        return tuple(__freeze(val) for val in obj)
+    return obj
+
+
+def __load_sanitisation_config(config_file):
+    """
+    Return the default config with all keys given in the JSON config_file (if any) overwritten.
+    """
+    config = dict(epcis_sanitiser.DEFAULT_CONFIG)
+    if config_file:
+        with open(config_file, 'r') as file:
+            data = file.read()
+        new_config = json.loads(data)
+        for key, val in new_config.items():  # only overwrite given keys
+            config[key] = val
+    return config
+
+
+async def __sanitise_and_store_stream(request, event_stream_type, format_name, return_events):
+    """
+    Parse and sanitise the posted document with a new event_stream_type of the streaming module and store the
+    sanitised events at once when the document is complete, so that nothing is stored of a malformed document.
+    """
+    start = time.perf_counter()
+    try:
+        if __pool() is None:
+            received_bytes, event_count, sanitised_events = await __sanitise_stream(
+                request, event_stream_type(), format_name)
+        else:
+            received_bytes, event_count, sanitised_events = await __sanitise_in_pool(
+                request, event_stream_type, format_name)
+    except (ElementTree.ParseError, ValueError) as ex:
+        DOCUMENTS.labels(format_name, "rejected").inc()
+        raise HTTPException(
+            status_code=400, detail="Invalid {}: {}".format(format_name, ex))
 
+    stored = await run_in_threadpool(__insert, sanitised_events)
+    stored_events = list(itertools.compress(sanitised_events, stored))
+    response = {"stored_events": len(stored_events)}
+    if __skips_known_events():
+        response["skipped_events"] = event_count - len(stored_events)
+    if return_events:
+        response["sanitised_events"] = stored_events
+
+    DOCUMENTS.labels(format_name, "stored").inc()
+    logs.summary("Stored document", format=format_name, stored_events=len(stored_events),
+                 skipped_events=event_count - len(stored_events), bytes=received_bytes,
+                 seconds=time.perf_counter() - start)
+    return response
+
+
+async def __sanitise_stream(request, event_stream, format_name):
+    """
+    Feed the request body chunk by chunk into the event_stream and sanitise the events completed by each chunk
+    right away. Returns the number of received bytes and of events, and the sanitised events.
+    """
+    received_bytes = 0
+    event_count = 0
+    sanitised_events = []
+    async for chunk in request.stream():
+        received_bytes += len(chunk)
+        # parsing and hashing is CPU bound, so it must not block the event loop
+        count, chunk_events = await run_in_threadpool(__parse_and_sanitise, event_stream.feed, chunk)
+        event_count += count
+        sanitised_events += chunk_events
+    __expect_body(received_bytes, format_name)
+    count, chunk_events = await run_in_threadpool(__parse_and_sanitise, event_stream.close)
+    return received_bytes, event_count + count, sanitised_events + chunk_events
+
+
+async def __sanitise_in_pool(request, event_stream_type, format_name):
+    """
+    Parse and sanitise the whole request body in the process pool, so that neither parsing nor hashing holds the
+    GIL of this process. Returns the number of received bytes and of events, and the sanitised events.
+    """
     body = await request.body()
-    if not body:
+    __expect_body(len(body), format_name)
+    with sanitiser.STAGE_SECONDS.time("pool"):
+        event_count, sanitised_events = await __pool().sanitise_document(event_stream_type, body)
+    return len(body), event_count, sanitised_events
+
+
+def __expect_body(received_bytes, format_name):
+    if not received_bytes:
         raise HTTPException(
-            status_code=400, detail="Expecting XML Body")
+            status_code=400, detail="Expecting {} Body".format(format_name))
 
-    xml_doc = body.decode('utf-8')
-    logging.debug("Sanitising XML events:\n %s", xml_doc)
 
-    events = xml_to_py.event_list_from_epcis_document_str(xml_doc)
-    return __sanitise_and_store_events(events)
+def __parse_and_sanitise(parse, *args):
+    """
+    Return the number of events returned by parse(*args) and the sanitised events.
+    """
+    with sanitiser.STAGE_SECONDS.time("parse"):
+        events = parse(*args)
+    return len(events), __sanitise_events(("EventList", "", events)) if events else []
 
 
-def __set_logging_cfg_from_db():
-    UniqueDoc = Query()
-    stored_config = db.search(UniqueDoc.id == "config")[0]
-    args = stored_config["args"]
-    logging.basicConfig(**__logger_cfg(args["log"]))
-    logging.debug("Setting log level: %s", args["log"])
+def __insert(sanitised_events):
+    """
+    Write the sanitised events to the store and return for each of them whether it was stored.
+    If known events are skipped, the store leaves out those whose eventId it knows already,
+    including the events stored by concurrent requests in the meantime.
+    """
+    with sanitiser.STAGE_SECONDS.time("store"):
+        ids = __writer().insert_many(sanitised_events, __skips_known_events())
+    stored = [id is not None for id in ids]
+    stored_count = sum(stored)
+    EVENTS.labels("stored").inc(stored_count)
+    EVENTS.labels("skipped").inc(len(stored) - stored_count)
+    return stored
 
 
-def __sanitise_and_store_events(events):
+def __sanitise_and_store_documents(documents, return_events):
+    return __store_documents(workers.sanitise_documents(documents, __service_config().plan), return_events)
 
-    UniqueDoc = Query()
-    stored_config = db.search(UniqueDoc.id == "config")[0]
-    args = stored_config["args"]
-    config = stored_config["config"]
 
-    logging.debug("\n\nEvents received:\n{}".format(events))
-    logging.debug("args:{}".format(args))
-    logging.debug("config:{}".format(config))
+def __store_documents(results, return_events):
+    """
+    Store the events of all documents sanitised by workers.sanitise_documents at once
+    and return the response of the batch endpoint.
+    """
+    all_sanitised_events = []
+    for (sanitised_events, error) in results:
+        DOCUMENTS.labels("NDJSON", "rejected" if error else "stored").inc()
+        all_sanitised_events += sanitised_events
+    stored = iter(__insert(all_sanitised_events))
+
+    response = {"stored_events": 0, "documents": []}
+    for (sanitised_events, error) in results:
+        if error:
+            response["documents"].append({"error": error})
+            continue
+        stored_events = list(itertools.compress(sanitised_events, itertools.islice(stored, len(sanitised_events))))
+        result = {"stored_events": len(stored_events)}
+        if __skips_known_events():
+            result["skipped_events"] = len(sanitised_events) - len(stored_events)
+        if return_events:
+            result["sanitised_events"] = stored_events
+        response["documents"].append(result)
+        response["stored_events"] += len(stored_events)
+    return response
+
+
+def __pool():
+    """
+    Return the pool of worker processes for the current sanitisation plan, or None if sanitising in threads.
+    The pool is replaced when the plan changes, e.g. on reload_config.
+    """
+    global _pool
+    processes = int(os.environ.get(PROCESSES_ENV, 0))
+    if processes <= 0:
+        return None
+    service_config = __service_config()
+    if _pool is None or _pool.plan is not service_config.plan:
+        with _pool_lock:
+            if _pool is None or _pool.plan is not service_config.plan:
+                if _pool is not None:
+                    _pool.shutdown()
+                _pool = workers.SanitiserPool(
+                    processes, service_config.plan,
+                    service_config.config.get("hash_cache_size", sanitiser.DEFAULT_HASH_CACHE_SIZE))
+    return _pool
+
+
+@contextlib.contextmanager
+def __admitted():
+    """
+    Admit an ingest request or reject it with 503 if already too many are being processed.
+    """
+    global _admission_queue
+    if _admission_queue is None:
+        _admission_queue = workers.AdmissionQueue(int(os.environ.get(MAX_PENDING_ENV, DEFAULT_MAX_PENDING)))
+    try:
+        with _admission_queue.admit():
+            yield
+    except workers.Overloaded as ex:
+        logging.warning("Rejecting request: %s", ex)
+        raise HTTPException(status_code=503, detail="Too many pending requests, retry later",
+                            headers={"Retry-After": "1"})
+
+
+def __sanitise_events(events):
+    """
+    Sanitise the events, leaving out those whose eventId is stored already if known events are skipped.
+    """
+    plan = __service_config().plan
 
-    sanitised_events = sanitiser.sanitise_events(
-        events=events, hashalg=args["algorithm"], dead_drop_url=args["dead_drop_url"], config=config)
+    logs.dump_payload(events, "Events received")
 
-    for event in sanitised_events:
-        db.insert(event)
+    known_event_ids = __store().known_event_ids if __skips_known_events() else None
+    sanitised_events = sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=plan,
+                                                 known_event_ids=known_event_ids)
+    EVENTS.labels("skipped").inc(len(events[2]) - len(sanitised_events))
+    return sanitised_events
 
-    return {"sanitised_events": sanitised_events}
+
+def __skips_known_events():
+    return __service_config().args.get("skip_known_events", False)
+
+
+def __hash_cache_hit_ratio():
+    info = sanitiser.hash_cache_info()
+    return metrics.ratio(info.hits, info.hits + info.misses)
 
 
 def __logger_cfg(log_lvl):
@@ -194,6 +564,18 @@ def __command_line_parsing(argv):
         help="Set the log level. Default: INFO.",
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         default="INFO")
+    parser.add_argument(
+        "-L",
+        "--log-format",
+        help="Format of log records: text, or one JSON object per line. Default: text.",
+        choices=logs.LOG_FORMATS,
+        default="text")
+    parser.add_argument(
+        "--payload-sample-rate",
+        help="Share (0 to 1) of payload dumps, i.e. log records with whole documents or events, "
+             "that are logged. Default: {}.".format(logs.DEFAULT_PAYLOAD_SAMPLE_RATE),
+        type=float,
+        default=logs.DEFAULT_PAYLOAD_SAMPLE_RATE)
     parser.add_argument(
         "-d",
         "--dead-drop-url",
@@ -207,6 +589,50 @@ def __command_line_parsing(argv):
         " Set the salt to empty string for unsalted hashing " +
         "and to None for including the clear text value without hashing"
     )
+    parser.add_argument(
+        "-s",
+        "--storage",
+        help="Storage backend for the sanitised events. TinyDB is meant for demos only.",
+        choices=storage.BACKENDS,
+        default="tinydb")
+    parser.add_argument(
+        "--db",
+        help="Path of the database file. Default: db.json for tinydb, db.sqlite for sqlite."
+    )
+    parser.add_argument(
+        "-g",
+        "--group-commit-window",
+        help="Time in ms to collect the events of concurrent requests before writing them to the store "
+             "all at once. Default: 0, i.e. write the events of each request immediately.",
+        type=float,
+        default=0)
+    parser.add_argument(
+        "-P",
+        "--processes",
+        help="Number of worker processes to parse and hash posted events in. "
+             "Default: 0, i.e. sanitise in threads of the webservice process.",
+        type=int,
+        default=0)
+    parser.add_argument(
+        "-q",
+        "--max-pending",
+        help="Maximal number of POST requests processed at the same time. Further requests are rejected "
+             "with 503 until one is done. Default: {}.".format(DEFAULT_MAX_PENDING),
+        type=int,
+        default=DEFAULT_MAX_PENDING)
+    parser.add_argument(
+        "-k",
+        "--skip-known-events",
+        help="Idempotent ingest: Skip posted events whose eventId is stored already, instead of storing them again. "
+             "Requires the eventId to be a sanitised field.",
+        action="store_true",
+        default=False)
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        help="Record metrics and serve them at /metrics in the Prometheus text format.",
+        action="store_true",
+        default=False)
     parser.add_argument(
         "-H",
         "--host",
@@ -225,6 +651,12 @@ def __command_line_parsing(argv):
         help="Development option: automatically reload if python sources change",
         action="store_true",
         default=False)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of webservice worker processes. More than one requires the sqlite storage. Default: 1.",
+        type=int,
+        default=1)
     parser.add_argument(
         "-R",
         "--root-path",
@@ -233,7 +665,12 @@ def __command_line_parsing(argv):
 
     args = parser.parse_args(argv)
 
-    logging.basicConfig(**__logger_cfg(args.log))
+    if args.workers > 1 and args.storage != "sqlite":
+        # TinyDB rewrites the whole file on every insert and each worker would keep its own EPC index
+        parser.error("Several workers need a storage that is safe for concurrent writers, use '-s sqlite'.")
+
+    logs.basic_config(args.log_format, **__logger_cfg(args.log))
+    logs.set_payload_sample_rate(args.payload_sample_rate)
     logging.debug("Setting log level: %s(%s)", args.log,
                   __logger_cfg(args.log)["level"])
 
@@ -253,12 +690,25 @@ def custom_openapi():
     openapi_schema["info"]["x-logo"] = {
         "url": "https://eecc.info/img/eecc/logo_213x182.png"
     }
+    openapi_schema["paths"]["/sanitise_json_event/"]["post"]["requestBody"] = {
+        "content": {
+            "application/json": {"schema": {"title": "JSON EPCIS Document", "type": "object"}},
+            "application/ld+json": {"schema": {"title": "JSON-LD EPCIS Document", "type": "object"}}
+        },
+        "required": True
+    }
     openapi_schema["paths"]["/sanitise_xml_event/"]["post"]["requestBody"] = {
         "content": {
             "application/xml": {"schema": {"title": "XML EPCIS Document", "type": "string"}}
         },
         "required": True
     }
+    openapi_schema["paths"]["/sanitise_documents/"]["post"]["requestBody"] = {
+        "content": {
+            "application/x-ndjson": {"schema": {"title": "One EPCIS Document per Line", "type": "string"}}
+        },
+        "required": True
+    }
     app.openapi_schema = openapi_schema
     return app.openapi_schema
 
@@ -268,24 +718,22 @@ app.openapi = custom_openapi
 
 def main(argv):
 
-    config = epcis_sanitiser.DEFAULT_CONFIG
     args = vars(__command_line_parsing(argv))
+    config = __load_sanitisation_config(args["sanitisation_config_file"])
 
-    if args["sanitisation_config_file"]:
-        with open(args["sanitisation_config_file"], 'r') as file:
-            data = file.read()
-        new_config = json.loads(data)
-        for key, val in new_config.items():  # only overwrite given keys
-            config[key] = val
-
-    UniqueDoc = Query()
-    db.remove(UniqueDoc.id == "config")
-    db.insert({"id": "config", "args": args, "config": config})
+    os.environ[STORAGE_ENV] = args["storage"]
+    if args["db"]:
+        os.environ[DB_PATH_ENV] = args["db"]
+    os.environ[GROUP_COMMIT_WINDOW_ENV] = str(args["group_commit_window"])
+    os.environ[PROCESSES_ENV] = str(args["processes"])
+    os.environ[MAX_PENDING_ENV] = str(args["max_pending"])
+    os.environ[SERVICE_CONFIG_ENV] = json.dumps({"args": args, "config": config})
 
     uvicorn_args = {"host": args["host"],
                     "port": int(args["port"]),
                     "log_level": args["log"].lower(),
-                    "reload": args["reload"]
+                    "reload": args["reload"],
+                    "workers": args["workers"]
                     }
 
     if args["root_path"]:
@@ -0,0 +1,167 @@
+"""
+
+.. module:: workers
+   :synopsis: Runs the CPU bound part of the webservice, i.e. parsing and hashing, in a pool of worker processes.
+              https://github.com/european-epc-competence-center/epcis-sanitisation
+
+.. moduleauthor:: Sebastian Schmittner <sebastian.schmittner@eecc.de>
+
+Copyright 2021 Sebastian Schmittner
+
+This program is free software: you can redistribute it and/or modify
+it under the terms given in the LICENSE file.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the LICENSE
+file for details.
+
+"""
+
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+import asyncio
+import contextlib
+import json
+import logging
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from concurrent.futures import ProcessPoolExecutor
+
+from epcis_event_hash_generator import json_to_py
+from epcis_event_hash_generator import xml_to_py
+
+from epcis_sanitiser import sanitiser
+
+# The sanitisation plan of the current worker process, see _init_worker
+_plan = None
+
+
+def _init_worker(plan, hash_cache_size):
+    global _plan
+    sanitiser.set_hash_cache_size(hash_cache_size)
+    _plan = plan
+
+
+def _sanitise_document(event_stream_type, document):
+    return sanitise_document(event_stream_type, document, _plan)
+
+
+def _sanitise_documents(documents):
+    return sanitise_documents(documents, _plan)
+
+
+def events_from_ndjson_line(line):
+    """
+    Parse a line holding either a JSON EPCIS document or a JSON string containing an XML one.
+    """
+    document = json.loads(line)
+    if isinstance(document, str):
+        return _events_from_xml(document)
+    return json_to_py.event_list_from_epcis_document_json(document)
+
+
+def _events_from_xml(document):
+    """
+    Parse the XML EPCIS document like xml_to_py does, but raise a ValueError if it has no EventList.
+    """
+    events = xml_to_py.event_list_from_epcis_document_str(document)
+    if events[0] == "EventList":
+        return events
+    # xml_to_py logs the error and returns an empty result, also for an EventList without events
+    if ElementTree.fromstring(document).find("*EventList") is None:
+        raise ValueError("No EPCIS document with an EventList")
+    return ("EventList", "", [])
+
+
+def sanitise_document(event_stream_type, document, plan):
+    """
+    Parse the whole document with a new event_stream_type of the streaming module and sanitise its events.
+    Returns the number of events and the sanitised events.
+    Raises an ElementTree.ParseError or a ValueError for malformed documents.
+    """
+    event_stream = event_stream_type()
+    with sanitiser.STAGE_SECONDS.time("parse"):
+        events = event_stream.feed(document) + event_stream.close()
+    return len(events), sanitiser.sanitise_events(("EventList", "", events), dead_drop_url=None, plan=plan)
+
+
+def sanitise_documents(documents, plan):
+    """
+    Parse and sanitise each of the NDJSON lines. Returns a pair (sanitised events, error) per document,
+    where the error is None for documents that could be sanitised.
+    """
+    results = []
+    for (i, document) in enumerate(documents):
+        try:
+            with sanitiser.STAGE_SECONDS.time("parse"):
+                events = events_from_ndjson_line(document)
+            results.append((sanitiser.sanitise_events(events, dead_drop_url=None, plan=plan), None))
+        except Exception as ex:
+            logging.warning("Rejecting document %s of batch: %r", i, ex)
+            results.append(([], "Invalid document: {!r}".format(ex)))
+    return results
+
+
+class SanitiserPool:
+    """
+    A pool of worker processes that parse and sanitise posted documents with the given plan, so that a large
+    document does not hold the GIL of the process serving requests. The plan is compiled again in every worker.
+    """
+
+    def __init__(self, processes, plan, hash_cache_size=sanitiser.DEFAULT_HASH_CACHE_SIZE):
+        self.plan = plan
+        self._executor = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(plan, hash_cache_size))
+
+    async def sanitise_document(self, event_stream_type, document):
+        """
+        Return the results of sanitise_document.
+        """
+        return await asyncio.wrap_future(self._executor.submit(_sanitise_document, event_stream_type, document))
+
+    async def sanitise_documents(self, documents):
+        """
+        Return the results of sanitise_documents.
+        """
+        return await asyncio.wrap_future(self._executor.submit(_sanitise_documents, documents))
+
+    def shutdown(self):
+        """
+        Stop the workers once they finished the jobs submitted so far, without waiting for that.
+        """
+        self._executor.shutdown(wait=False)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionQueue:
+    """
+    Bounds the number of requests that are processed at the same time.
+    Requests beyond that are rejected right away instead of piling up in memory.
+    """
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def admit(self):
+        """
+        Hold a slot while in the context. Raises Overloaded if all max_pending slots are taken.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded("{} requests pending".format(self.pending))
+            self.pending += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.pending -= 1
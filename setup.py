@@ -17,11 +17,12 @@ setuptools.setup(
     packages=["epcis_event_hash_generator"],
     classifiers=[
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     entry_points={
         "console_scripts": [
             "cli=epcis_event_hash_generator.main:main",
@@ -32,6 +33,10 @@ setuptools.setup(
         'epcis_event_hash_generator>=1.6.2',
         'fastapi>=0.63.0',
         'uvicorn>=0.13.4',
-        'tinydb>=4.4.0'
+        'tinydb>=4.8.0'
     ],
+    extras_require={
+        'test': ['pytest', 'httpx'],
+        'benchmark': ['httpx']
+    },
 )
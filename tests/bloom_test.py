@@ -0,0 +1,16 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser.bloom import BloomFilter
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add("ni:///sha-256;{}".format(i))
+
+    assert all("ni:///sha-256;{}".format(i) in bloom for i in range(1000))
+    false_positives = sum("ni:///sha-256;x{}".format(i) in bloom for i in range(10000))
+    assert false_positives < 300
@@ -0,0 +1,54 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import compact
+
+
+class _Dictionary:
+    def __init__(self):
+        self.strings = []
+
+    def id_of(self, string, add=True):
+        if string not in self.strings:
+            if not add:
+                return None
+            self.strings.append(string)
+        return self.strings.index(string) + 1
+
+    def string_of(self, id):
+        return self.strings[id - 1]
+
+
+_HASH = "ni:///sha-256;" + "ab" * 32
+
+
+def test_round_trip():
+    event = {
+        "request_event_data_at": "https://never.land",
+        "eventType": "ObjectEvent",
+        "eventId": _HASH + "?ver=CBV2.0",
+        "eventTime": "2020-03-04T11:00:30.000+01:00",
+        "epcList": [_HASH, "ni:///sha-512;" + "0f" * 64 + "?type=urn:epcglobal:cbv:sdt:owning_party",
+                    "ni:///sha-256;" + "AB" * 32, "ni:///sha-256;short"],
+        "childEPCs": [],
+        "parentID": None,
+        "quantity": 1.5
+    }
+    dictionary = _Dictionary()
+    encoded = compact.encode_event(event, dictionary)
+
+    decoded = compact.decode_event(encoded, dictionary)
+    assert decoded == event
+    assert list(decoded) == list(event)
+    assert len(encoded) < len(str(event)) / 2
+
+
+def test_keys():
+    dictionary = _Dictionary()
+    assert compact.encode_key(_HASH + "?ver=CBV2.0", dictionary, add=False) is None
+    key = compact.encode_key(_HASH + "?ver=CBV2.0", dictionary)
+    assert len(key) == 35
+    assert compact.encode_key(_HASH + "?ver=CBV2.0", dictionary, add=False) == key
+    assert compact.encode_key("urn:epc:id:sgtin:4012345.011111.9876", dictionary, add=False) is not None
@@ -0,0 +1,141 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from dead_drop import dead_drop
+
+from fastapi.testclient import TestClient
+
+import json
+import pytest
+import sys
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv(dead_drop.DB_PATH_ENV, str(tmp_path / "dead_drop_db.json"))
+    monkeypatch.setattr(dead_drop, "_store", None)
+    return TestClient(dead_drop.app)
+
+
+def _request(requesting, endpoint, valid_until=None):
+    request = {"requesting": requesting, "recipient": {"endpoint": endpoint}}
+    if valid_until:
+        request["valid_until"] = valid_until
+    return request
+
+
+def test_find_request(client):
+    client.put("/request/", json=_request("sha-256;a", "https://one.example"))
+    client.put("/request/", json=_request("sha-256;b", "https://two.example"))
+    client.put("/request/", json=_request("sha-256;a", "https://three.example"))
+    client.put("/request/", json=_request("sha-256;a", "https://expired.example", "2000-01-01T00:00:00"))
+
+    matches = client.get("/request/sha-256;a").json()
+    assert [match["recipient"]["endpoint"] for match in matches] == ["https://one.example", "https://three.example"]
+    assert client.get("/request/sha-256;c").status_code == 404
+
+
+def test_store_is_persistent(tmp_path):
+    path = str(tmp_path / "dead_drop_db.json")
+    store = dead_drop.RequestStore(path)
+    store.insert(_request("sha-256;a", "https://one.example", "2100-01-01 00:00:00"))
+    store.insert(_request("sha-256;b", "https://two.example", "2000-01-01 00:00:00"))
+    assert store.find("sha-256;b") == []
+    assert store.remove_expired() == [2]
+
+    reopened = dead_drop.RequestStore(path)
+    assert reopened.all() == [_request("sha-256;a", "https://one.example", "2100-01-01 00:00:00")]
+
+
+def test_reaper(tmp_path, monkeypatch):
+    monkeypatch.setenv(dead_drop.DB_PATH_ENV, str(tmp_path / "dead_drop_db.json"))
+    monkeypatch.setenv(dead_drop.REAP_INTERVAL_ENV, "0.1")
+    monkeypatch.setattr(dead_drop, "_store", None)
+
+    with TestClient(dead_drop.app) as client:
+        valid_until = (datetime.now() + timedelta(seconds=1)).strftime(dead_drop.DATE_FORMAT)
+        client.put("/request/", json=_request("sha-256;a", "https://one.example", valid_until))
+        assert len(dead_drop._store.all(now=0)) == 1
+        time.sleep(2.5)
+        assert dead_drop._store.all(now=0) == []
+
+
+def test_reads_during_reaping(tmp_path):
+    store = dead_drop.RequestStore(str(tmp_path / "dead_drop_db.json"))
+    for i in range(200):
+        store.insert(_request("sha-256;a", "https://expired.example", "2000-01-01 00:00:00"))
+    errors = []
+
+    def find():
+        try:
+            while len(store):
+                store.find("sha-256;a", now=0)
+                store.find_many(["sha-256;a"], now=0)
+                store.all(now=0)
+                store.page(limit=50, now=0)
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=find) for _ in range(3)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        while store.remove_expired(now=time.time()):
+            pass
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
+    assert store.find("sha-256;a", now=0) == []
+
+
+def test_find_requests_in_batch(client):
+    client.put("/request/", json=_request("sha-256;a", "https://one.example"))
+    client.put("/request/", json=_request("sha-256;b", "https://two.example"))
+    client.put("/request/", json=_request("sha-256;c", "https://expired.example", "2000-01-01T00:00:00"))
+
+    found = client.post("/request/batch", json=["sha-256;a", "sha-256;c", "sha-256;d", "sha-256;a"]).json()
+    assert list(found) == ["sha-256;a"]
+    assert found["sha-256;a"][0]["recipient"]["endpoint"] == "https://one.example"
+    assert client.post("/request/batch", json=[]).json() == {}
+
+
+def test_paginated_requests(client):
+    for i in range(5):
+        client.put("/request/", json=_request("sha-256;" + str(i), "https://one.example"))
+    client.put("/request/", json=_request("sha-256;x", "https://expired.example", "2000-01-01T00:00:00"))
+
+    first = client.get("/request?limit=3")
+    assert [match["requesting"] for match in first.json()] == ["sha-256;0", "sha-256;1", "sha-256;2"]
+    second = client.get("/request?limit=3&cursor=" + first.headers[dead_drop.NEXT_CURSOR_HEADER])
+    assert [match["requesting"] for match in second.json()] == ["sha-256;3", "sha-256;4"]
+    assert dead_drop.NEXT_CURSOR_HEADER not in second.headers
+
+    lines = client.get("/request?ndjson=true").text.splitlines()
+    assert [json.loads(line)["requesting"] for line in lines] == ["sha-256;" + str(i) for i in range(5)]
+
+
+def test_metrics(client, monkeypatch):
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(dead_drop.REGISTRY, "enabled", True)
+    client.put("/request/", json=_request("sha-256;a", "https://one.example"))
+    client.post("/request/batch", json=["sha-256;a", "sha-256;b"])
+    client.get("/request/sha-256;c")
+
+    lines = client.get("/metrics").text.splitlines()
+    assert "dead_drop_stored_requests 1" in lines
+    assert 'dead_drop_lookups_total{outcome="hit"} 1' in lines
+    assert 'dead_drop_lookups_total{outcome="miss"} 2' in lines
+    assert "dead_drop_lookup_hit_ratio 0.3333333333333333" in lines
+    assert 'dead_drop_http_requests_total{endpoint="find_request",status="404"} 1' in lines
@@ -0,0 +1,27 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser.epc_index import EpcIndex, epcs_of_event
+
+
+def test_epcs_of_event():
+    event = {
+        "eventType": "AggregationEvent",
+        "parentID": "ni:///sha-256;p",
+        "childEPCs": ["ni:///sha-256;a", "ni:///sha-256;b"],
+        "bizStep": "urn:epcglobal:cbv:bizstep:packing"
+    }
+    assert epcs_of_event(event) == {"ni:///sha-256;p", "ni:///sha-256;a", "ni:///sha-256;b"}
+
+
+def test_lookup_is_deduplicated_and_ordered():
+    index = EpcIndex()
+    index.add(1, {"epcList": ["ni:///sha-256;a"], "quantityList": ["ni:///sha-256;a"]})
+    index.add(2, {"inputEPCList": ["ni:///sha-256;b"], "outputEPCList": ["ni:///sha-256;a"]})
+    index.add(3, {"parentID": "ni:///sha-256;a"})
+
+    assert index.lookup("ni:///sha-256;a") == [1, 2, 3]
+    assert index.lookup("ni:///sha-256;b") == [2]
+    assert index.lookup("ni:///sha-256;c") == []
@@ -0,0 +1,40 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import logs
+
+import json
+import logging
+
+
+class _Payload:
+    formatted = 0
+
+    def __str__(self):
+        _Payload.formatted += 1
+        return "payload"
+
+
+def test_summary(caplog):
+    with caplog.at_level(logging.INFO):
+        logs.summary("Stored document", events=3, seconds=0.5)
+    (record,) = caplog.records
+    assert record.getMessage() == "Stored document: events=3 seconds=0.500000"
+    assert record.funcName == "test_summary"
+    assert json.loads(logs.JsonFormatter().format(record))["events"] == 3
+
+
+def test_dump_payload_is_sampled(caplog, monkeypatch):
+    monkeypatch.setattr(logs, "_payload_sample_rate", 1)
+    with caplog.at_level(logging.INFO):
+        logs.dump_payload(_Payload(), "Events of %s", "file.xml")
+    assert caplog.records == [] and _Payload.formatted == 0
+
+    with caplog.at_level(logging.DEBUG):
+        logs.dump_payload(_Payload(), "Events of %s", "file.xml")
+        monkeypatch.setattr(logs, "_payload_sample_rate", 0)
+        logs.dump_payload(_Payload(), "Events of %s", "file.xml")
+    assert [record.getMessage() for record in caplog.records] == ["Events of file.xml: payload"]
+    assert caplog.records[0].funcName == "test_dump_payload_is_sampled"
@@ -0,0 +1,50 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    counter = metrics.Counter("things_total", "Number of things.", ["kind"], registry)
+    histogram = metrics.Histogram("wait_seconds", "Time waited.", buckets=[0.1, 1], registry=registry)
+    metrics.FunctionMetric("answer", "The answer.", lambda: 42, registry=registry)
+
+    counter.labels("a").inc()
+    assert counter.value("a") == 0  # disabled
+
+    registry.enabled = True
+    counter.labels('say "hi"').inc(2)
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.labels().observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP things_total Number of things.",
+        "# TYPE things_total counter",
+        'things_total{kind="say \\"hi\\""} 2',
+        "# HELP wait_seconds Time waited.",
+        "# TYPE wait_seconds histogram",
+        'wait_seconds_bucket{le="0.1"} 2',
+        'wait_seconds_bucket{le="1"} 3',
+        'wait_seconds_bucket{le="+Inf"} 4',
+        "wait_seconds_sum 3.65",
+        "wait_seconds_count 4",
+        "# HELP answer The answer.",
+        "# TYPE answer gauge",
+        "answer 42",
+    ]
+
+
+def test_time():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram("stage_seconds", "Time per stage.", ["stage"], registry=registry)
+    with histogram.time("hash"):
+        pass
+    assert "stage_seconds_count" not in registry.render()
+
+    registry.enabled = True
+    with histogram.time("hash"):
+        pass
+    assert 'stage_seconds_count{stage="hash"} 1' in registry.render()
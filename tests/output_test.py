@@ -0,0 +1,34 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import output
+
+import io
+import json
+
+
+EVENTS = [{"eventId": "ni:///sha-256;a", "bizStep": 'say "hi"'}, {"epcList": ["ni:///sha-256;b"]}]
+
+
+def test_json_array(monkeypatch):
+    monkeypatch.setattr(output, "BUFFER_SIZE", 10)
+    file = io.StringIO()
+    with output.EventWriter(file) as writer:
+        writer.write_many(iter(EVENTS[:1]))
+        writer.write_many(iter(EVENTS[1:]))
+    assert json.loads(file.getvalue()) == EVENTS
+    assert writer.count == 2
+
+    file = io.StringIO()
+    with output.EventWriter(file):
+        pass
+    assert json.loads(file.getvalue()) == []
+
+
+def test_ndjson():
+    file = io.StringIO()
+    with output.EventWriter(file, "ndjson") as writer:
+        writer.write_many(EVENTS)
+    assert [json.loads(line) for line in file.getvalue().splitlines()] == EVENTS
@@ -0,0 +1,43 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import reader
+
+from epcis_event_hash_generator import events_from_file_reader
+
+import pytest
+import xml.etree.ElementTree as ElementTree
+
+DOCUMENTS = ["events/ReferenceEventHashAlgorithm.xml", "events/SanitisationEventDataset.xml",
+             "events/epcisDocWithSingleEvent.jsonld"]
+
+
+def test_expand_paths():
+    assert reader.expand_paths(["events"], [".sanitised.json"]) == DOCUMENTS
+    assert reader.expand_paths(["events/*.xml", "events/epcisDocWithSingleEvent.jsonld"]) == DOCUMENTS
+    assert reader.expand_paths(["e*s"], [".sanitised.json"]) == DOCUMENTS
+    assert reader.expand_paths(["events/ReferenceEventHashAlgorithm.sanitised.json"], [".sanitised.json"]) == \
+        ["events/ReferenceEventHashAlgorithm.sanitised.json"]
+
+
+@pytest.mark.parametrize("path", DOCUMENTS)
+def test_iter_events(path):
+    assert list(reader.iter_events(path, chunk_size=100)) == events_from_file_reader.event_list_from_file(path)[2]
+
+
+def test_iter_events_of_unknown_files(tmp_path):
+    empty = tmp_path / "empty.xml"
+    empty.write_text("")
+    with pytest.raises(ElementTree.ParseError):
+        list(reader.iter_events(str(empty)))
+    with pytest.raises(ValueError):
+        list(reader.iter_events("events/ReferenceEventHashAlgorithm.txt"))
+
+
+def test_prefetched():
+    assert list(reader.prefetched(DOCUMENTS, ahead=1)) == DOCUMENTS
+    paths = reader.prefetched(DOCUMENTS * 10, ahead=1)
+    assert next(paths) == DOCUMENTS[0]
+    paths.close()
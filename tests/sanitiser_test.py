@@ -9,6 +9,7 @@ from epcis_event_hash_generator import hash_generator
 
 import logging
 import hashlib
+import pickle
 
 _dead_drop_url = 'https://never.land'
 
@@ -117,3 +118,136 @@ def test_type_parameters():
         events=events, dead_drop_url=_dead_drop_url)[0]
 
     assert expected == sanitised
+
+
+def test_plan():
+    events = ('EventList', '', [
+        ('ObjectEvent', '', [
+            ('action', 'OBSERVE', []),
+            ('bizStep', 'urn:epcglobal:cbv:bizstep:departing', []),
+            ('epcList', '', [
+                ('epc', 'urn:epc:id:sscc:4012345.0000000111', [])
+            ]),
+            ('eventTime', '2020-03-04T11:00:30.000+01:00', [])
+        ])
+    ])
+
+    config = {
+        "dead_drop_url": _dead_drop_url,
+        "sanitised_fields": {
+            "eventId": "",
+            "epcList": "Salt",
+            "action": None
+        }
+    }
+    plan = sanitiser.compile_plan(config, 'sha256')
+
+    expected = {
+        'request_event_data_at': _dead_drop_url,
+        'eventId': hash_fct(hash_generator.epcis_hashes_from_events(events)[0]),
+        'epcList': [hash_fct('urn:epc:id:sscc:4012345.0000000111Salt')],
+        'action': 'OBSERVE'
+    }
+
+    sanitised = sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=plan)[0]
+
+    assert expected == sanitised
+    assert list(sanitised) == list(expected)  # fields in config order
+    assert sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=plan)[0] == sanitised
+
+    unpickled_plan = pickle.loads(pickle.dumps(plan))
+    assert sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=unpickled_plan)[0] == sanitised
+
+
+def test_skip_known_events():
+    def event(action):
+        return ('ObjectEvent', '', [('action', action, []), ('eventTime', '2020-03-04T11:00:30.000+01:00', [])])
+
+    events = ('EventList', '', [event('OBSERVE'), event('ADD'), event('OBSERVE')])
+    plan = sanitiser.compile_plan(hashalg='sha256', dead_drop_url=_dead_drop_url)
+
+    all_sanitised = sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=plan)
+    assert len(all_sanitised) == 3
+    assert sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=plan,
+                                     known_event_ids=lambda event_ids: set()) == all_sanitised[:2]
+    known_event_id = all_sanitised[0]["eventId"]
+    assert sanitiser.sanitise_events(events=events, dead_drop_url=None, plan=plan,
+                                     known_event_ids=lambda event_ids: {known_event_id}) == all_sanitised[1:2]
+
+
+def test_iter_sanitise_events():
+    def event(action):
+        return ('ObjectEvent', '', [('action', action, []), ('eventTime', '2020-03-04T11:00:30.000+01:00', [])])
+
+    plan = sanitiser.compile_plan(hashalg='sha256', dead_drop_url=_dead_drop_url)
+    all_sanitised = sanitiser.sanitise_events(
+        events=('EventList', '', [event(action) for action in ['OBSERVE', 'ADD', 'DELETE']]), dead_drop_url=None,
+        plan=plan)
+
+    taken = []
+
+    def parsed_events():
+        for action in ['OBSERVE', 'ADD', 'DELETE']:
+            taken.append(action)
+            yield event(action)
+
+    sanitised_events = sanitiser.iter_sanitise_events(parsed_events(), plan=plan, batch_size=2)
+    assert next(sanitised_events) == all_sanitised[0]
+    assert taken == ['OBSERVE', 'ADD']
+    assert list(sanitised_events) == all_sanitised[1:]
+
+
+def test_hash_cache():
+    events = ('EventList', '', [
+        ('ObjectEvent', '', [
+            ('epcList', '', [
+                ('epc', 'urn:epc:id:sscc:4012345.0000000111', []),
+                ('epc', 'urn:epc:id:sscc:4012345.0000000111', [])
+            ])
+        ])
+    ])
+    config = {"dead_drop_url": _dead_drop_url, "hash_cache_size": 16, "sanitised_fields": {"epcList": ""}}
+
+    sanitiser.set_hash_cache_size(0)
+    sanitised = sanitiser.sanitise_events(events=events, dead_drop_url=None, config=config)[0]
+
+    assert sanitised["epcList"] == [hash_fct('urn:epc:id:sscc:4012345.0000000111')] * 2
+    cache_info = sanitiser.hash_cache_info()
+    assert (cache_info.hits, cache_info.misses, cache_info.maxsize) == (1, 1, 16)
+
+    sanitiser.set_hash_cache_size(sanitiser.DEFAULT_HASH_CACHE_SIZE)
+
+
+def test_hash_cache_hashes_misses_at_once(monkeypatch):
+    hashed = []
+    hash_many = sanitiser.SaltedHasher.hash_many
+
+    def counting_hash_many(self, values):
+        hashed.append(list(values))
+        return hash_many(self, values)
+
+    monkeypatch.setattr(sanitiser.SaltedHasher, "hash_many", counting_hash_many)
+    hasher = sanitiser.salted_hasher('sha256', '')
+    cache = sanitiser._HashCache(4)
+
+    assert cache.hash_many(hasher, ['a', 'b', 'a']) == [hash_fct('a'), hash_fct('b'), hash_fct('a')]
+    assert cache.hash_many(hasher, ['b', 'c']) == [hash_fct('b'), hash_fct('c')]
+    assert cache.hash(hasher, 'a') == hash_fct('a')
+    assert cache.info() == (3, 3, 4, 4)
+    cache.hash_many(hasher, ['d', 'e'])
+    assert cache.hash(hasher, 'b') == hash_fct('b')  # evicted
+    assert hashed == [['a', 'b'], ['c'], ['d', 'e'], ['b']]
+
+    uncached = sanitiser._HashCache(0)
+    assert uncached.hash_many(hasher, ['a', 'a']) == [hash_fct('a')] * 2
+    assert uncached.info() == (0, 0, 0, 0)
+
+
+def test_salted_hasher():
+    hasher = sanitiser.SaltedHasher('sha256', 'urn:epc:id:gdti:0614141.00002.PO-123')
+
+    expected = hash_fct('urn:epc:id:pgln:0614141.00000urn:epc:id:gdti:0614141.00002.PO-123')
+
+    assert hasher.hash('urn:epc:id:pgln:0614141.00000') == expected
+    assert hasher.hash_bytes(b'urn:epc:id:pgln:0614141.00000') == expected
+    assert hasher.hash_many(['urn:epc:id:pgln:0614141.00000'] * 2) == [expected] * 2
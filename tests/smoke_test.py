@@ -3,11 +3,96 @@ try:
 except ImportError:
     from context import epcis_sanitiser  # noqa: F401
 
+from epcis_sanitiser import __main__
 from epcis_sanitiser.__main__ import main
 
+from concurrent.futures import Future
+
+import json
 import logging
+import pytest
 
 
 def test_main(caplog):
     caplog.set_level(logging.DEBUG)
     main(["events/ReferenceEventHashAlgorithm.xml"])
+
+
+def test_main_parallel(capsys):
+    files = ["events/ReferenceEventHashAlgorithm.xml", "events/SanitisationEventDataset.xml",
+             "events/epcisDocWithSingleEvent.jsonld"]
+    main(files)
+    serial = capsys.readouterr().out
+
+    main(["-j", "2"] + files)
+    assert capsys.readouterr().out == serial
+
+
+def test_main_parallel_split_files(capsys, monkeypatch):
+    main(["events/SanitisationEventDataset.xml"])
+    serial = capsys.readouterr().out
+
+    monkeypatch.setattr(__main__, "SPLIT_FILE_SIZE", 0)
+    monkeypatch.setattr(__main__, "CHUNK_SIZE", 5)
+    main(["-j", "2", "events/SanitisationEventDataset.xml"])
+    assert capsys.readouterr().out == serial
+
+
+def test_split_file_chunks_in_flight(monkeypatch):
+    class Pool:
+        submitted = 0
+
+        def submit(self, fct, *args):
+            Pool.submitted += 1
+            future = Future()
+            future.set_result(fct(*args))
+            return future
+
+    monkeypatch.setattr(__main__, "CHUNK_SIZE", 1)
+    __main__._init_plan(epcis_sanitiser.DEFAULT_CONFIG, "sha256", "")
+    in_flight = []
+    for (i, _) in enumerate(__main__._sanitise_split_file("events/SanitisationEventDataset.xml", Pool(), 2)):
+        in_flight.append(Pool.submitted - i)
+    assert len(in_flight) == 33
+    assert max(in_flight) == 4
+
+
+def test_main_output(tmp_path, capsys):
+    main(["-f", "ndjson", "events/ReferenceEventHashAlgorithm.xml", "events/epcisDocWithSingleEvent.jsonld"])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+
+    output_file = tmp_path / "sanitised.json"
+    main(["-o", str(output_file), "events/ReferenceEventHashAlgorithm.xml", "events/epcisDocWithSingleEvent.jsonld"])
+    assert json.loads(output_file.read_text()) == [json.loads(line) for line in lines]
+
+
+def test_main_directory(tmp_path, capsys, caplog):
+    files = ["events/ReferenceEventHashAlgorithm.xml", "events/SanitisationEventDataset.xml",
+             "events/epcisDocWithSingleEvent.jsonld"]
+    main(files)
+    expected = capsys.readouterr().out
+
+    main(["events"])
+    assert capsys.readouterr().out == expected
+
+    (tmp_path / "malformed.xml").write_text("<epcis:EPCISDocument>")
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(tmp_path), "events"])
+    assert exit_info.value.code == 1
+    # the JSON array is left incomplete
+    assert capsys.readouterr().out + "\n]\n" == expected
+    assert "Could not read" in caplog.text
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_main_batch_removes_output_of_malformed_files(tmp_path, jobs):
+    with open("events/SanitisationEventDataset.xml", "r") as file:
+        data = file.read()
+    (tmp_path / "truncated.xml").write_text(data[:len(data) // 2])
+    (tmp_path / "complete.xml").write_text(data)
+
+    with pytest.raises(SystemExit):
+        main(["-b", "-j", jobs, str(tmp_path)])
+    assert len(json.loads((tmp_path / "complete.sanitised.json").read_text())) == 33
+    assert not (tmp_path / "truncated.sanitised.json").exists()
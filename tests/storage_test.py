@@ -0,0 +1,203 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import storage
+from epcis_sanitiser.migrate_db import migrate
+
+import pytest
+import sqlite3
+import sys
+import threading
+
+from tinydb import TinyDB
+
+_events = [
+    {"eventId": "ni:///sha-256;e1", "epcList": ["ni:///sha-256;a", "ni:///sha-256;b"]},
+    {"eventId": "ni:///sha-256;e2", "parentID": "ni:///sha-256;a", "childEPCs": ["ni:///sha-256;a"]},
+    {"eventId": "ni:///sha-256;e1", "quantityList": ["ni:///sha-256;c"]}
+]
+
+
+@pytest.fixture(params=storage.BACKENDS)
+def store(request, tmp_path):
+    return storage.open_store(request.param, str(tmp_path / storage.DEFAULT_PATHS[request.param]))
+
+
+def test_insert_and_find(store):
+    store.insert_many(_events)
+
+    assert len(store) == 3
+    assert store.all() == _events
+    assert store.find_by_event_id("ni:///sha-256;e1") == [_events[0], _events[2]]
+    assert store.find_by_epc("ni:///sha-256;a") == [_events[0], _events[1]]
+    assert store.find_by_epc("ni:///sha-256;c") == [_events[2]]
+    assert store.find_by_epc("ni:///sha-256;d") == []
+
+
+def _legacy_db(path):
+    with TinyDB(path) as db:
+        db.insert({"id": "config", "args": {"log": "INFO"}, "config": {}})
+    return storage.open_store("tinydb", path)
+
+
+def test_config_is_not_an_event(tmp_path):
+    store = _legacy_db(str(tmp_path / "db.json"))
+    store.insert_many(_events[:1])
+
+    assert store.all() == _events[:1]
+    assert len(store) == 1
+
+
+def test_migrate(tmp_path):
+    source = _legacy_db(str(tmp_path / "db.json"))
+    source.insert_many(_events)
+
+    target = storage.open_store("sqlite", str(tmp_path / "db.sqlite"))
+    source.all = None  # read page by page instead
+    assert migrate(source, target, batch_size=2) == 3
+
+    assert target.all() == _events
+    assert target.find_by_epc("ni:///sha-256;b") == [_events[0]]
+
+
+def test_group_commit(tmp_path):
+    class CountingStore(storage.SQLiteEventStore):
+        writes = 0
+
+        def insert_many(self, events, skip_known=False):
+            CountingStore.writes += 1
+            return super().insert_many(events, skip_known)
+
+    store = CountingStore(str(tmp_path / "db.sqlite"))
+    writer = storage.GroupCommitWriter(store, 0.2)
+
+    results = [None] * len(_events)
+
+    def insert(i):
+        results[i] = writer.insert_many([_events[i]])
+
+    threads = [threading.Thread(target=insert, args=(i,)) for i in range(len(_events))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert CountingStore.writes == 1
+    assert sorted(results) == [[1], [2], [3]]
+    assert store.find_by_event_id("ni:///sha-256;e2") == [_events[1]]
+
+
+def test_insert_skipping_known_events(store):
+    assert store.insert_many(_events[:1], skip_known=True) == [1]
+    ids = store.insert_many(_events + [{"epcList": []}], skip_known=True)
+    assert ids[0] is None and ids[2] is None
+    assert None not in (ids[1], ids[3])
+    assert store.find_by_event_id("ni:///sha-256;e1") == [_events[0]]
+
+    assert store.insert_many(_events[:1])[0] is not None
+    assert store.find_by_event_id("ni:///sha-256;e1") == [_events[0], _events[0]]
+    assert store.insert_many(_events[:1], skip_known=True) == [None]
+
+
+def test_group_commit_skipping_known_events(tmp_path):
+    store = storage.open_store("sqlite", str(tmp_path / "db.sqlite"))
+    writer = storage.GroupCommitWriter(store, 0.2)
+    results = [None] * 3
+
+    def insert(i):
+        results[i] = writer.insert_many(_events[:2], skip_known=True)
+
+    threads = [threading.Thread(target=insert, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results, key=lambda ids: ids[0] is None) == [[1, 2], [None, None], [None, None]]
+    assert len(store) == 2
+
+
+def test_page(store):
+    store.insert_many(_events)
+
+    first = store.page(0, 2)
+    assert [event for (_, event) in first] == _events[:2]
+    assert [event for (_, event) in store.page(first[-1][0], 2)] == _events[2:]
+    assert store.page(first[-1][0] + 10, 2) == []
+
+
+def test_known_event_ids(store, tmp_path):
+    store.insert_many(_events[:1])
+    assert store.known_event_ids(["ni:///sha-256;e1", "ni:///sha-256;e2"]) == {"ni:///sha-256;e1"}
+    store.insert_many(_events[1:2])
+    assert store.known_event_ids(["ni:///sha-256;e1", "ni:///sha-256;e2"]) == {"ni:///sha-256;e1", "ni:///sha-256;e2"}
+    assert store.known_event_ids([]) == set()
+
+
+def test_known_event_ids_of_other_writers(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    store = storage.open_store("sqlite", path)
+    assert store.known_event_ids(["ni:///sha-256;e1"]) == set()
+    storage.open_store("sqlite", path).insert_many(_events)
+    assert store.known_event_ids(["ni:///sha-256;e1"]) == {"ni:///sha-256;e1"}
+
+
+def test_reject_unknown_format_versions(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA user_version = 42")
+    connection.close()
+
+    with pytest.raises(ValueError):
+        storage.open_store("sqlite", path)
+
+
+def _run_concurrently(targets):
+    """
+    Run the targets in threads of their own, switching threads often, and return the exceptions they raised.
+    """
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch in the middle of file accesses
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    return errors
+
+
+@pytest.mark.parametrize("backend", storage.BACKENDS)
+def test_concurrent_reads_and_writes(backend, tmp_path):
+    path = str(tmp_path / storage.DEFAULT_PATHS[backend])
+    store = storage.open_store(backend, path)
+    done = threading.Event()
+
+    def insert():
+        try:
+            for i in range(50):
+                store.insert_many([dict(event, eventId="{}-{}".format(event["eventId"], i)) for event in _events])
+        finally:
+            done.set()
+
+    def find():
+        while not done.is_set():
+            store.find_by_epc("ni:///sha-256;a")
+            store.find_by_event_id("ni:///sha-256;e1-0")
+            store.page(0, 10)
+
+    assert _run_concurrently([insert, find, find, find]) == []
+    assert len(store) == 150
+    assert len(storage.open_store(backend, path).find_by_epc("ni:///sha-256;a")) == 100
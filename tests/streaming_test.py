@@ -0,0 +1,154 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import streaming
+
+from epcis_event_hash_generator import json_to_py
+from epcis_event_hash_generator import xml_to_py
+
+import json
+import pytest
+import xml.etree.ElementTree as ElementTree
+
+
+def _feed_in_chunks(stream, data, chunk_size):
+    events = []
+    for start in range(0, len(data), chunk_size):
+        events += stream.feed(data[start:start + chunk_size])
+    return events + stream.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 1 << 20])
+@pytest.mark.parametrize("filename", ["events/ReferenceEventHashAlgorithm.xml", "events/SanitisationEventDataset.xml"])
+def test_xml_stream_matches_xml_to_py(filename, chunk_size):
+    with open(filename, "rb") as file:
+        data = file.read()
+
+    expected = xml_to_py.event_list_from_epcis_document_str(data.decode("utf-8"))[2]
+
+    assert _feed_in_chunks(streaming.XmlEventStream(), data, chunk_size) == expected
+
+
+def test_xml_stream_emits_events_early():
+    stream = streaming.XmlEventStream()
+    assert stream.feed(b"<epcis:EPCISDocument xmlns:epcis='urn:epcglobal:epcis:xsd:1'><EPCISBody><EventList>") == []
+    assert stream.feed(b"<ObjectEvent><action>OBSERVE</action></ObjectEvent><ObjectEvent>") == [
+        ("ObjectEvent", "", [("action", "OBSERVE", [])])]
+
+
+def test_xml_stream_rejects_malformed_xml():
+    with pytest.raises(ElementTree.ParseError):
+        streaming.XmlEventStream().feed(b"<EPCISDocument><EPCISBody></EventList>")
+
+
+@pytest.mark.parametrize("data", [b"<a/>", b"<EPCISDocument><EPCISBody></EPCISBody></EPCISDocument>",
+                                  b"<EPCISDocument><EventList><ObjectEvent/></EventList></EPCISDocument>"])
+def test_xml_stream_rejects_documents_without_event_list(data):
+    with pytest.raises(ValueError):
+        _feed_in_chunks(streaming.XmlEventStream(), data, 10)
+
+
+def test_xml_stream_accepts_empty_event_list():
+    data = b"<EPCISDocument><EPCISBody><extension><EventList/></extension></EPCISBody></EPCISDocument>"
+    assert _feed_in_chunks(streaming.XmlEventStream(), data, 10) == []
+
+
+def _json_document(events):
+    return {
+        "@context": ["https://gs1.github.io/EPCIS/epcis-context.jsonld", {"example": "http://ns.example.com/epcis/"}],
+        "isA": "EPCISDocument",
+        "schemaVersion": 2.0,
+        "epcisBody": {"eventList": events}
+    }
+
+
+def _json_event(i):
+    return {
+        "isA": "ObjectEvent",
+        "action": "OBSERVE",
+        "epcList": ["urn:epc:id:sgtin:0614141.107346.{}".format(i), "urn:epc:id:sgtin:0614141.107346.ü"],
+        "eventTime": "2005-04-03T20:33:31.116000-06:00",
+        "example:temperature": 12.5 + i,
+        "readPoint": {"id": "urn:epc:id:sgln:0614141.07346.1234"}
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 1 << 20])
+def test_json_stream_matches_json_to_py(chunk_size):
+    document = _json_document([_json_event(i) for i in range(5)])
+    data = json.dumps(document, indent=2, ensure_ascii=False).encode("utf-8")
+
+    expected = json_to_py.event_list_from_epcis_document_json(document)[2]
+
+    assert _feed_in_chunks(streaming.JsonEventStream(), data, chunk_size) == expected
+
+
+def test_json_stream_single_event():
+    with open("events/epcisDocWithSingleEvent.jsonld", "rb") as file:
+        data = file.read()
+
+    expected = json_to_py.event_list_from_epcis_document_str(data)[2]
+
+    assert _feed_in_chunks(streaming.JsonEventStream(), data, 10) == expected
+
+
+def test_json_stream_with_context_after_body():
+    document = _json_document([_json_event(i) for i in range(3)])
+    document["@context"][1]["later"] = "http://ns.example.com/later/"
+    document["epcisBody"]["eventList"][0]["later:temperature"] = 1.5
+    reordered = {"epcisBody": document["epcisBody"], "@context": document["@context"]}
+    data = json.dumps(reordered)
+
+    stream = streaming.JsonEventStream()
+    assert stream.feed(data[:data.index("@context")]) == []
+    events = stream.feed(data[data.index("@context"):]) + stream.close()
+
+    # json_to_py keeps the namespaces it saw, so this comes after streaming
+    assert events == json_to_py.event_list_from_epcis_document_json(document)[2]
+
+
+def test_json_stream_with_context_object():
+    context = {"object": "http://ns.example.com/object/"}
+    document = {"@context": dict(context, term={"@id": "object:term"}),
+                "epcisBody": {"eventList": [dict(_json_event(1), **{"object:weight": 2})]}}
+    events = _feed_in_chunks(streaming.JsonEventStream(), json.dumps(document), 100)
+
+    # json_to_py keeps the namespaces it saw, so this comes after streaming
+    assert events == json_to_py.event_list_from_epcis_document_json(dict(document, **{"@context": [context]}))[2]
+
+
+def test_json_stream_rejects_unknown_prefixes():
+    document = {"epcisBody": {"eventList": [dict(_json_event(1), **{"unknown:temperature": 1})]}}
+    with pytest.raises(ValueError):
+        _feed_in_chunks(streaming.JsonEventStream(), json.dumps(document), 100)
+
+
+def test_json_stream_emits_events_early():
+    stream = streaming.JsonEventStream()
+    data = json.dumps(_json_document([_json_event(1), _json_event(2)]))
+
+    assert len(stream.feed(data[:data.index("OBSERVE", data.index("OBSERVE") + 1)])) == 1
+
+
+@pytest.mark.parametrize("data", ['{"epcisBody": {"eventList": [{"isA": "ObjectEvent"}', '{"epcisBody": [}', '[]', '{}',
+                                  '{"foo": 1}', '{"epcisBody": {}}', '{"epcisBody": {"eventList": [1]}}',
+                                  '{"epcisBody": {"event": {"isA": "ObjectEvent"}}} {}',
+                                  '{"@context": 1, "epcisBody": {"eventList": []}}'])
+def test_json_stream_rejects_malformed_documents(data):
+    with pytest.raises(ValueError):
+        _feed_in_chunks(streaming.JsonEventStream(), data, 3)
+
+
+def test_json_stream_rejects_syntax_errors_right_away():
+    data = json.dumps(_json_document([_json_event(1), _json_event(2)])).replace('"action":', '"action"', 1)
+    with pytest.raises(ValueError):
+        streaming.JsonEventStream().feed(data[:data.rindex('{"isA": "ObjectEvent"')])
+
+
+def test_json_stream_bounds_value_size():
+    data = json.dumps(_json_document([_json_event(1)]))
+    stream = streaming.JsonEventStream(max_value_size=100)
+    with pytest.raises(ValueError):
+        stream.feed(data[:data.index("eventList") + 150])
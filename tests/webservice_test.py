@@ -0,0 +1,274 @@
+try:
+    from .context import epcis_sanitiser
+except ImportError:
+    from context import epcis_sanitiser  # noqa: F401
+
+from epcis_sanitiser import metrics
+from epcis_sanitiser import storage
+from epcis_sanitiser import streaming
+from epcis_sanitiser import webservice
+
+from fastapi.testclient import TestClient
+
+import asyncio
+import json
+import os
+import pytest
+import threading
+
+
+@pytest.fixture(params=storage.BACKENDS)
+def client(request, tmp_path, monkeypatch):
+    db_path = str(tmp_path / storage.DEFAULT_PATHS[request.param])
+    monkeypatch.setenv(webservice.STORAGE_ENV, request.param)
+    monkeypatch.setenv(webservice.DB_PATH_ENV, db_path)
+    monkeypatch.setattr(webservice, "_store", None)
+    monkeypatch.setattr(webservice, "_service_config", None)
+    monkeypatch.setattr(webservice, "_pool", None)
+    monkeypatch.setattr(webservice, "_admission_queue", None)
+
+    args = {"algorithm": "sha256", "log": "INFO", "dead_drop_url": "https://never.land",
+            "sanitisation_config_file": None}
+    service_config = {"args": args, "config": epcis_sanitiser.DEFAULT_CONFIG}
+    monkeypatch.setenv(webservice.SERVICE_CONFIG_ENV, json.dumps(service_config))
+
+    return TestClient(webservice.app)
+
+
+def test_store_and_lookup_xml(client):
+    with open("events/ReferenceEventHashAlgorithm.xml", "r") as file:
+        response = client.post("/sanitise_xml_event/", content=file.read())
+    assert response.status_code == 200
+    sanitised_event = response.json()["sanitised_events"][0]
+    assert sanitised_event["request_event_data_at"] == "https://never.land"
+
+    epc = sanitised_event["epcList"][0][len("ni:///"):]
+    assert client.get("/events_for_epc/" + epc).json() == [sanitised_event]
+    assert client.get("/events_for_epc/sha-256;unknown").status_code == 404
+
+
+def test_store_json(client):
+    with open("events/epcisDocWithSingleEvent.jsonld", "r") as file:
+        response = client.post("/sanitise_json_event/", json=json.load(file))
+    assert response.status_code == 200
+    assert client.get("/db_dump").json() == response.json()["sanitised_events"]
+
+
+def test_store_json_with_context_after_body(client):
+    with open("events/epcisDocWithSingleEvent.jsonld", "r") as file:
+        document = json.load(file)
+    document["@context"][1]["reordered"] = "http://ns.example.com/reordered/"
+    document["epcisBody"]["event"]["reordered:temperature"] = 12.5
+    reordered = {key: document[key] for key in ["epcisBody", "isA", "@context"]}
+
+    response = client.post("/sanitise_json_event/", content=json.dumps(reordered))
+    assert response.status_code == 200
+    assert response.json()["stored_events"] == 1
+
+    del reordered["@context"]
+    reordered["epcisBody"]["event"]["unknown:temperature"] = 1
+    assert client.post("/sanitise_json_event/", content=json.dumps(reordered)).status_code == 400
+
+
+def test_reject_json_without_events(client):
+    with open("events/epcisDocWithSingleEvent.jsonld", "r") as file:
+        document = file.read()
+    for body in ["{}", '{"foo": 1}', document + "garbage", '{"@context": {"a": "b"}, "epcisBody": {}}']:
+        assert client.post("/sanitise_json_event/", content=body).status_code == 400
+    assert client.get("/db_dump").json() == []
+
+
+def test_parse_off_the_event_loop(client, monkeypatch):
+    on_event_loop = []
+
+    class JsonEventStream(streaming.JsonEventStream):
+        def feed(self, chunk):
+            on_event_loop.append(asyncio._get_running_loop() is not None)
+            return super().feed(chunk)
+
+    monkeypatch.setattr(streaming, "JsonEventStream", JsonEventStream)
+    with open("events/epcisDocWithSingleEvent.jsonld", "r") as file:
+        assert client.post("/sanitise_json_event/", content=file.read()).status_code == 200
+    assert on_event_loop and not any(on_event_loop)
+
+
+def test_reload_config(client, tmp_path):
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"dead_drop_url": "https://elsewhere.land"}))
+    args = {"algorithm": "sha256", "log": "INFO", "dead_drop_url": "", "sanitisation_config_file": str(config_file)}
+    os.environ[webservice.SERVICE_CONFIG_ENV] = json.dumps({"args": args, "config": epcis_sanitiser.DEFAULT_CONFIG})
+
+    assert client.post("/reload_config").json()["dead_drop_url"] == "https://elsewhere.land"
+    # only this worker process reloads, the environment of the service stays as it was started
+    assert json.loads(os.environ[webservice.SERVICE_CONFIG_ENV])["config"] == epcis_sanitiser.DEFAULT_CONFIG
+
+
+def test_store_xml_without_returning_events(client):
+    with open("events/SanitisationEventDataset.xml", "r") as file:
+        response = client.post("/sanitise_xml_event/?return_events=false", content=file.read())
+    assert response.json() == {"stored_events": 33}
+    assert len(client.get("/db_dump").json()) == 33
+
+
+def test_reject_malformed_xml(client):
+    assert client.post("/sanitise_xml_event/", content="").status_code == 400
+    assert client.post("/sanitise_xml_event/", content="<EPCISDocument></EventList>").status_code == 400
+    assert client.post("/sanitise_xml_event/", content="<a/>").status_code == 400
+
+    with open("events/SanitisationEventDataset.xml", "r") as file:
+        data = file.read()
+    assert client.post("/sanitise_xml_event/", content=data[:len(data) // 2]).status_code == 400
+    assert client.get("/db_dump").json() == []
+
+
+def test_store_json_without_returning_events(client):
+    with open("events/epcisDocWithSingleEvent.jsonld", "r") as file:
+        response = client.post("/sanitise_json_event/?return_events=false", content=file.read())
+    assert response.json() == {"stored_events": 1}
+    assert client.post("/sanitise_json_event/", content='{"epcisBody": ').status_code == 400
+
+
+def test_paginated_db_dump(client):
+    with open("events/SanitisationEventDataset.xml", "r") as file:
+        client.post("/sanitise_xml_event/?return_events=false", content=file.read())
+    all_events = client.get("/db_dump").json()
+
+    pages = []
+    response = client.get("/db_dump?limit=10")
+    while True:
+        pages += response.json()
+        if webservice.NEXT_CURSOR_HEADER not in response.headers:
+            break
+        response = client.get("/db_dump?limit=10&cursor=" + response.headers[webservice.NEXT_CURSOR_HEADER])
+    assert pages == all_events
+
+    response = client.get("/db_dump?ndjson=true")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == all_events
+    assert client.get("/db_dump?limit=0").status_code == 422
+
+
+def test_store_documents_in_batch(client):
+    with open("events/epcisDocWithSingleEvent.jsonld", "r") as file:
+        json_document = json.dumps(json.load(file))
+    with open("events/ReferenceEventHashAlgorithm.xml", "r") as file:
+        xml_document = json.dumps(file.read())
+    body = "\n".join([json_document, "{\"epcisBody\": 42}", "", xml_document, json_document]) + "\n"
+
+    response = client.post("/sanitise_documents/", content=body)
+    assert response.status_code == 200
+    results = response.json()["documents"]
+    assert [result.get("stored_events") for result in results] == [1, None, 1, 1]
+    assert "error" in results[1]
+    assert response.json()["stored_events"] == 3
+    stored_events = [result["sanitised_events"][0] for result in results if "error" not in result]
+    assert client.get("/db_dump").json() == stored_events
+    assert client.post("/sanitise_documents/", content="\n").status_code == 400
+
+
+def test_reject_documents_without_event_list(client):
+    empty = '<epcis:EPCISDocument xmlns:epcis="urn:epcglobal:epcis:xsd:1"><EPCISBody><EventList/></EPCISBody>' \
+        '</epcis:EPCISDocument>'
+    documents = ["<EPCISDocument><EPCISBody></EPCISBody></EPCISDocument>", "<foo/>", "<EPCISDocument>", empty]
+
+    response = client.post("/sanitise_documents/", content="\n".join(json.dumps(document) for document in documents))
+    results = response.json()["documents"]
+    assert ["error" in result for result in results] == [True, True, True, False]
+    assert results[3] == {"stored_events": 0, "sanitised_events": []}
+
+
+def test_sanitise_in_worker_processes(client, monkeypatch):
+    with open("events/SanitisationEventDataset.xml", "r") as file:
+        document = file.read()
+    expected = client.post("/sanitise_xml_event/", content=document).json()
+
+    monkeypatch.setenv(webservice.PROCESSES_ENV, "2")
+    try:
+        assert client.post("/sanitise_xml_event/", content=document).json() == expected
+        assert client.post("/sanitise_xml_event/", content=document[:len(document) // 2]).status_code == 400
+        assert client.post("/sanitise_xml_event/", content="<a/>").status_code == 400
+        assert client.post("/sanitise_json_event/", content="{}").status_code == 400
+        response = client.post("/sanitise_documents/", content=json.dumps(document) + "\n")
+        assert response.json()["documents"][0]["sanitised_events"] == expected["sanitised_events"]
+    finally:
+        webservice._pool.shutdown()
+
+
+def test_reject_when_overloaded(client, monkeypatch):
+    monkeypatch.setenv(webservice.MAX_PENDING_ENV, "0")
+    response = client.post("/sanitise_json_event/", content="{}")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_several_workers_need_sqlite():
+    with pytest.raises(SystemExit):
+        webservice.main(["-w", "2"])
+
+
+def test_skip_known_events(client, monkeypatch):
+    service_config = json.loads(os.environ[webservice.SERVICE_CONFIG_ENV])
+    service_config["args"]["skip_known_events"] = True
+    monkeypatch.setenv(webservice.SERVICE_CONFIG_ENV, json.dumps(service_config))
+    monkeypatch.setattr(webservice, "_service_config", None)
+
+    with open("events/ReferenceEventHashAlgorithm.xml", "r") as file:
+        document = file.read()
+    first = client.post("/sanitise_xml_event/", content=document).json()
+    assert first["stored_events"] == 1 and first["skipped_events"] == 0
+    assert client.post("/sanitise_xml_event/", content=document).json() == \
+        {"stored_events": 0, "skipped_events": 1, "sanitised_events": []}
+
+    response = client.post("/sanitise_documents/", content=json.dumps(document) + "\n" + json.dumps(document))
+    assert response.json()["documents"] == [{"stored_events": 0, "skipped_events": 1, "sanitised_events": []}] * 2
+    assert len(client.get("/db_dump").json()) == 1
+
+
+@pytest.mark.parametrize("group_commit_window", ["0", "50"])
+def test_skip_known_events_of_concurrent_requests(client, monkeypatch, group_commit_window):
+    service_config = json.loads(os.environ[webservice.SERVICE_CONFIG_ENV])
+    service_config["args"]["skip_known_events"] = True
+    monkeypatch.setenv(webservice.SERVICE_CONFIG_ENV, json.dumps(service_config))
+    monkeypatch.setattr(webservice, "_service_config", None)
+    monkeypatch.setenv(webservice.GROUP_COMMIT_WINDOW_ENV, group_commit_window)
+
+    with open("events/SanitisationEventDataset.xml", "r") as file:
+        document = file.read()
+    responses = [None] * 3
+
+    def post(i):
+        responses[i] = client.post("/sanitise_xml_event/?return_events=false", content=document).json()
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(responses))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(response["stored_events"] for response in responses) == 33
+    assert sum(response["skipped_events"] for response in responses) == 66
+    assert len(client.get("/db_dump").json()) == 33
+
+
+def test_metrics(client, monkeypatch):
+    # the service config enables the registry, which is restored for the tests after this one
+    monkeypatch.setattr(metrics.REGISTRY, "enabled", metrics.REGISTRY.enabled)
+    assert client.get("/metrics").status_code == 404
+
+    service_config = json.loads(os.environ[webservice.SERVICE_CONFIG_ENV])
+    service_config["args"]["metrics"] = True
+    monkeypatch.setenv(webservice.SERVICE_CONFIG_ENV, json.dumps(service_config))
+    monkeypatch.setattr(webservice, "_service_config", None)
+    assert client.get("/metrics").status_code == 200
+
+    stored_before = webservice.EVENTS.value("stored")
+    with open("events/ReferenceEventHashAlgorithm.xml", "r") as file:
+        client.post("/sanitise_xml_event/", content=file.read())
+    assert webservice.EVENTS.value("stored") == stored_before + 1
+
+    lines = client.get("/metrics").text.splitlines()
+    for stage in ["parse", "hash", "sanitise", "store"]:
+        assert any(line.startswith('epcis_sanitiser_stage_seconds_count{stage="' + stage + '"}') for line in lines)
+    assert "epcis_sanitiser_stored_events 1" in lines
+    assert any(line.startswith('epcis_sanitiser_http_requests_total{endpoint="sanitise_and_store_xml_event",'
+                               'status="200"}') for line in lines)